@@ -0,0 +1,143 @@
+"""Synthetic cards, and a local stand-in of the remote API serving them
+(with their pictures), for the benchmarks.
+The cards are generated from their index only, so that the data is
+the same from one run, and one revision, to the next."""
+
+import io, json, zlib, random, threading, urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+PER_SET = 500 # cards in each set
+PAGE_SIZE = 100 # cards per page, as the real API
+WORDS = ["elf", "goblin", "dragon", "angel", "knight", "wizard", "zombie", "spirit",
+        "merfolk", "beast", "soldier", "shaman", "giant", "vampire", "druid", "sphinx"]
+COLORS = ["White", "Blue", "Black", "Red", "Green"]
+RARITIES = ["Common"]*6 + ["Uncommon"]*3 + ["Rare"]*2 + ["Mythic Rare"]
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ" # of the set codes
+
+
+def set_code(index):
+        """Code of the set holding the card of index : S00, S01... then SZZ"""
+        n = index // PER_SET
+        return "S" + DIGITS[n//36 % 36] + DIGITS[n%36]
+
+def card_index(code, number):
+        """Index of the card of that set code and number"""
+        return (DIGITS.index(code[1])*36 + DIGITS.index(code[2])) * PER_SET + int(number) - 1
+
+def raw_card(index, base="http://127.0.0.1"):
+        """The raw dict the API would send for the card of index,
+        its pictures being served at base"""
+        rng = random.Random(index)
+        words = rng.sample(WORDS, 2)
+        multiverseid = index + 1
+        return {
+                "name":"{} {}".format(*words).title(),
+                "set":set_code(index),
+                "number":str(index % PER_SET + 1),
+                "multiverseid":multiverseid,
+                "id":"{:040x}".format(index),
+                "cmc":rng.randrange(8),
+                "colors":[rng.choice(COLORS)],
+                "type":"Creature — {}".format(words[0].title()),
+                "types":["Creature"],
+                "subtypes":[words[0].title()],
+                "rarity":rng.choice(RARITIES),
+                "text":"When {} enters the battlefield, draw a card.".format(" ".join(words)),
+                "imageUrl":"{}/img/{}.jpg".format(base, multiverseid),
+                "foreignNames":[{"language":"French", "name":"{} {}".format(*reversed(words)).title(),
+                        "imageUrl":"{}/img/{}-fr.jpg".format(base, multiverseid), "multiverseid":multiverseid}]}
+
+def picture():
+        """An encoded picture, of the size of those of the API"""
+        from PIL import Image
+        img = Image.new("RGB", (223, 310))
+        img.putdata([((x*7) % 256, (x*13) % 256, (x*3) % 256) for x in range(223*310)])
+        file = io.BytesIO()
+        img.save(file, format="JPEG")
+        return file.getvalue()
+
+
+class FakeAPI(ThreadingHTTPServer) :
+        """Serves the first cards synthetic cards under /v1 (see endpoint),
+        and their pictures under /img, on a free port of localhost.
+        Counts the requests it answered."""
+
+        daemon_threads = True
+
+        def __init__(self, cards):
+                super().__init__(("127.0.0.1", 0), Handler)
+                self.cards = cards
+                self.base = "http://127.0.0.1:{}".format(self.server_address[1])
+                self.endpoint = self.base + "/v1"
+                self.picture = picture()
+                self.requests = 0
+                threading.Thread(target=self.serve_forever, daemon=True).start()
+
+        def close(self):
+                self.shutdown()
+                self.server_close()
+
+        def query(self, params):
+                """The raw cards matching the query params"""
+                if "set" in params :
+                        code = params["set"]
+                        first = card_index(code, 1) if len(code) == 3 and code.startswith("S") else self.cards
+                        indexes = range(first, min(first+PER_SET, self.cards))
+                else :
+                        indexes = range(self.cards)
+                if "number" in params :
+                        number = params["number"]
+                        indexes = [i for i in indexes if str(i % PER_SET + 1) == number]
+                if "multiverseid" in params :
+                        indexes = [i for i in indexes if str(i+1) == params["multiverseid"]]
+                return [raw_card(i, self.base) for i in indexes]
+
+
+class Handler(BaseHTTPRequestHandler) :
+
+        protocol_version = "HTTP/1.1" # keep-alive, as the real servers
+        disable_nagle_algorithm = True # the headers and the body are sent apart
+
+        def do_GET(self):
+                self.server.requests += 1
+                url = urllib.parse.urlsplit(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                parts = url.path.strip("/").split("/")
+                if parts[0] == "img" :
+                        return self.reply(self.server.picture, "image/jpeg")
+                if parts[:2] == ["v1", "sets"] :
+                        codes = sorted({set_code(i) for i in range(0, self.server.cards, PER_SET)})
+                        page = [{"code":code, "name":"Set "+code} for code in codes] if params.get("page", "1") == "1" else []
+                        return self.json({"sets":page})
+                if parts[:2] == ["v1", "cards"] and len(parts) == 3 :
+                        index = int(parts[2], 16)
+                        return self.json({"card":raw_card(index, self.server.base)})
+                if parts[:2] == ["v1", "cards"] :
+                        page = int(params.pop("page", 1))
+                        params.pop("language", None) # every card has a French name
+                        found = self.server.query(params)
+                        return self.json({"cards":found[(page-1)*PAGE_SIZE:page*PAGE_SIZE]})
+                self.send_error(404)
+
+        def json(self, obj):
+                data = json.dumps(obj).encode()
+                etag = '"{:08x}"'.format(zlib.crc32(data))
+                if self.headers.get("If-None-Match") == etag :
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.end_headers()
+                        return
+                self.reply(data, "application/json", etag)
+
+        def reply(self, data, type, etag=None):
+                self.send_response(200)
+                self.send_header("Content-Type", type)
+                self.send_header("Content-Length", str(len(data)))
+                if etag is not None :
+                        self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(data)
+
+        def log_message(self, *args):
+                pass
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Benchmarks of the application, on synthetic collections of growing sizes,
+the remote API and the pictures being served by a local stand-in (see fakeapi).
+Writes the results as JSON ; two of them may be compared with --compare.
+The benchmarks of the GUI are skipped when there's no display."""
+
+import argparse, json, pathlib, platform, shutil, statistics, subprocess, sys, tempfile, time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import mtgsdk
+from core import Card, add_card, write_to_file, read_from_file, merge_files
+from inventory import Inventory
+from sortkeys import SortKeys
+from filterindex import FilterIndex
+from columns import Columns, FIELDS
+from imgcache import ImgCache, PackStore, open_cache
+from fetcher import Fetcher
+from mirror import Mirror
+from httpcache import HttpCache
+from fakeapi import FakeAPI, raw_card
+
+
+SIZES = [1000, 10000, 100000]
+RUNS = 3
+LOOKUPS = 50 # cards added or looked up by the search benchmarks
+PICTURES = 100 # pictures read or downloaded by the pictures benchmarks (they fit in the RAM cache)
+QUERIES = ["elf", "dragon w", "zzz", "e"] # some match many cards, some none
+
+
+class Bench :
+        """Runs the benchmarks, and collects their results"""
+
+        def __init__(self, runs, tmp):
+                self.runs = runs
+                self.tmp = tmp
+                self.results = list()
+
+        def time(self, name, size, ops, f, setup=lambda:None):
+                """Times f, which does ops operations, self.runs times
+                (setup being called before each run, untimed)"""
+                times = list()
+                for i in range(self.runs) :
+                        setup()
+                        start = time.perf_counter()
+                        f()
+                        times.append(time.perf_counter() - start)
+                self.results.append(dict(name=name, size=size, ops=ops,
+                        best=min(times), median=statistics.median(times), times=times))
+                print("{:24} {:>7} {:10.4f} s".format(name, size or "", min(times)), file=sys.stderr)
+
+        def skip(self, name, size, reason):
+                self.results.append(dict(name=name, size=size, skipped=reason))
+                print("{:24} {:>7} skipped : {}".format(name, size or "", reason), file=sys.stderr)
+
+        def fresh_cache(self):
+                """Points Card to a new, empty images cache"""
+                path = pathlib.Path(tempfile.mkdtemp(dir=str(self.tmp)))
+                shutil.copy(str(ROOT/"back.jpeg"), str(path/"back.jpeg"))
+                Card.cache = open_cache(path)
+                Card.fetcher = Fetcher(Card.cache)
+
+        def fresh_mirror(self):
+                """Points Card to a new, empty mirror, and responses cache"""
+                Card.mirror = Mirror(tempfile.mktemp(dir=str(self.tmp), suffix=".db"))
+                Card.http = HttpCache(tempfile.mktemp(dir=str(self.tmp), suffix=".db"))
+
+
+def collection(bench, cards):
+        size = len(cards)
+        path = bench.tmp/"collection.mtg"
+        def write():
+                with open(path, "wb") as file :
+                        write_to_file(file, cards)
+        def read():
+                with open(path, "rb") as file :
+                        read_from_file(file)
+        bench.time("collection.write", size, size, write)
+        bench.time("collection.read", size, size, read)
+        bench.time("collection.merge", size, 2*size, lambda:merge_files(bench.tmp/"merged.mtg", [path, path]))
+
+def model(bench, cards):
+        """The work of CardPresenter.update, and of the collection window, without the GUI"""
+        size = len(cards)
+        attrs = ["foreign_name"]
+        def sort():
+                keys = SortKeys(attrs)
+                keys.sync(cards)
+                sorted(cards, key=keys.key(attrs))
+        bench.time("sortkeys.sort", size, size, sort)
+        index = FilterIndex()
+        def filter():
+                for query in QUERIES :
+                        index.match(query)
+        bench.time("filterindex.build", size, size, lambda:FilterIndex().sync(cards))
+        bench.time("filterindex.match", size, len(QUERIES), filter, setup=lambda:index.sync(cards))
+        columns = Columns()
+        bench.time("columns.build", size, size, lambda:columns.sync(cards))
+        bench.time("columns.group", size, len(FIELDS), lambda:[columns.group(by) for by in FIELDS])
+
+def search(bench, cards, new):
+        """Adding cards not stored yet (looked up remotely, in the responses cache,
+        then in the mirror), and cards stored already (merged)"""
+        size = len(cards)
+        inventory = Inventory(cards)
+        ids = [(card["set"], card["number"]) for card in new]
+        stored = [(card.set, card.number) for card in cards[::max(1, size//LOOKUPS)]][:LOOKUPS]
+        def add(ids):
+                def f():
+                        for code, number in ids :
+                                add_card(inventory, code, number)
+                return f
+        def forget():
+                for code, number in ids :
+                        card = inventory.get(code, number)
+                        if card is not None :
+                                inventory.remove(card)
+        bench.time("search.add.remote", size, len(ids), add(ids), setup=lambda:(forget(), bench.fresh_mirror()))
+        def uncached():
+                forget()
+                Card.mirror = Mirror(tempfile.mktemp(dir=str(bench.tmp), suffix=".db"))
+        bench.time("search.add.cached", size, len(ids), add(ids), setup=uncached)
+        bench.time("search.add.mirror", size, len(ids), add(ids), setup=forget)
+        bench.time("search.dedupe", size, len(stored), add(stored))
+
+def pictures(bench, api):
+        cards = [Card(raw_card(i, api.base)) for i in range(PICTURES)]
+        path = bench.tmp/"pictures.pack"
+        cache = None
+        def empty():
+                nonlocal cache
+                if cache is not None :
+                        cache.close()
+                if path.exists() :
+                        path.unlink()
+                cache = ImgCache(PackStore(path))
+        def put():
+                for card in cards :
+                        cache.put(card.multiverseid, api.picture)
+        bench.time("imgcache.put", None, PICTURES, put, setup=empty)
+        cache.close()
+        def cold():
+                nonlocal cache
+                cache = ImgCache(PackStore(path))
+        def read():
+                for card in cards :
+                        cache.variant(card.multiverseid)
+        bench.time("imgcache.cold", None, PICTURES, read, setup=cold)
+        bench.time("imgcache.warm", None, PICTURES, read)
+        def fetch():
+                left = [len(cards)]
+                def done(img):
+                        left[0] -= 1
+                for card in cards :
+                        if card.fetchimg(done) is not None :
+                                left[0] -= 1
+                while left[0] :
+                        Card.fetcher.deliver()
+                        time.sleep(0.001)
+        bench.time("fetchimg", None, PICTURES, fetch, setup=bench.fresh_cache)
+        return cards
+
+def gui(bench, cards, new, pictures):
+        """The GUI itself, when there's a display"""
+        size = len(cards)
+        names = ["update.sort", "update.filter", "search.insert"] if size else ["getimg"]
+        try :
+                from tkinter import tix
+                root = tix.Tk()
+        except Exception as e :
+                for name in names :
+                        bench.skip(name, size or None, str(e).splitlines()[0])
+                return
+        from gui import CardPresenter
+        root.withdraw()
+        presenter = CardPresenter(root)
+        if size :
+                bench.time("update.sort", size, size, lambda:presenter.update(Inventory(cards)))
+                bench.time("update.filter", size, len(QUERIES),
+                        lambda:[(presenter.filter_query.set(q), presenter.update()) for q in QUERIES],
+                        setup=lambda:presenter.filter_query.set(""))
+                added = [Card(dict(raw)) for raw in new]
+                def forget():
+                        presenter.filter_query.set("")
+                        presenter.update(Inventory(cards))
+                bench.time("search.insert", size, len(added), lambda:[presenter.insert_card(card) for card in added], setup=forget)
+        else :
+                bench.time("getimg", None, len(pictures), lambda:[card.getimg() for card in pictures], setup=bench.fresh_cache)
+        root.destroy()
+
+
+def revision():
+        try :
+                return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=str(ROOT),
+                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip() or None
+        except OSError :
+                return None
+
+def compare(old, new):
+        """Prints the ratios of the best times of new to those of old"""
+        old = {(r["name"], r["size"]):r for r in json.load(open(old))["results"] if "best" in r}
+        for r in json.load(open(new))["results"] :
+                before = old.get((r["name"], r["size"]))
+                if "best" not in r or before is None :
+                        continue
+                print("{:24} {:>7} {:10.4f} -> {:10.4f} s  x{:.2f}".format(r["name"], r["size"] or "",
+                        before["best"], r["best"], r["best"]/before["best"]))
+
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description=__doc__)
+        parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="cards in the collections")
+        parser.add_argument("--runs", type=int, default=RUNS, help="runs of each benchmark, the best one is kept")
+        parser.add_argument("-o", "--output", help="file to write the results to (the standard output by default)")
+        parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two results instead")
+        args = parser.parse_args()
+        if args.compare :
+                compare(*args.compare)
+                exit(0)
+        tmp = pathlib.Path(tempfile.mkdtemp())
+        api = FakeAPI(max(args.sizes) + LOOKUPS)
+        mtgsdk.config.__endpoint__ = api.endpoint
+        bench = Bench(args.runs, tmp)
+        bench.fresh_cache()
+        bench.fresh_mirror()
+        try :
+                new = [raw_card(max(args.sizes) + i, api.base) for i in range(LOOKUPS)]
+                for size in args.sizes :
+                        cards = [Card(raw_card(i, api.base)) for i in range(size)]
+                        collection(bench, cards)
+                        model(bench, cards)
+                        search(bench, cards, new)
+                        gui(bench, cards, new, None)
+                gui(bench, [], None, pictures(bench, api))
+        finally :
+                api.close()
+                shutil.rmtree(str(tmp), ignore_errors=True)
+        report = dict(revision=revision(), date=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                python=platform.python_version(), platform=platform.platform(),
+                requests=api.requests, results=bench.results)
+        out = sys.stdout if args.output is None else open(args.output, "w")
+        with out :
+                json.dump(report, out, indent=1)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Measures how fast the command line tools of the zipapp start, and fails
+if they got slower than the limit or load the modules they shouldn't
+(the GUI, PIL, mtgsdk, the network...), see core.
+The limit is relative to the start of an interpreter loading the standard
+modules the tools need anyway (the floor), measured in the same run, so
+that it holds on slower machines too."""
+
+import argparse, pathlib, subprocess, sys, tempfile, time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from build import build
+from core import Card, write_to_file
+from fakeapi import raw_card
+
+
+FORBIDDEN = ["tkinter", "PIL", "mtgsdk", "http", "urllib.request", "email", "sqlite3",
+        "concurrent", "imgcache", "fetcher", "mirror", "gui"] # modules the tools mustn't load
+FORBIDDEN_LIMITED = ["numpy", "columns"] # nor those whose time is limited
+FLOOR = ["runpy", "zipimport", "argparse", "pathlib", "json", "zlib", "struct", "threading",
+        "collections", "time", "shutil", "locale"] # what the tools import whatever their code (argparse needs the last two)
+LIMIT = 1.0 # time above the floor allowed, relative to that of the floor above the bare interpreter start
+
+
+def timed(command, runs):
+        """Best wall time of command, in ms (the others measure the noise of the machine)"""
+        times = list()
+        for i in range(runs) :
+                start = time.perf_counter()
+                subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+                times.append((time.perf_counter()-start) * 1000)
+        return min(times)
+
+def imported(command):
+        """Names of the modules command imports"""
+        err = subprocess.run(command[:1]+["-X", "importtime"]+command[1:], check=True,
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True).stderr
+        return [line.split("|")[-1].strip() for line in err.splitlines() if line.startswith("import time:")][1:]
+
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description=__doc__)
+        parser.add_argument("--runs", type=int, default=20)
+        parser.add_argument("--cards", type=int, default=2000, help="cards in the collection file used")
+        parser.add_argument("--limit", type=float, default=LIMIT, help="time allowed above the floor, relative to the floor's above the bare interpreter start")
+        args = parser.parse_args()
+        failed = False
+        with tempfile.TemporaryDirectory() as tmp :
+                tmp = pathlib.Path(tmp)
+                pyz, collection = tmp/"MTG.pyz", tmp/"collection.mtg"
+                build(pyz)
+                with open(collection, "wb") as file :
+                        write_to_file(file, [Card(raw_card(i)) for i in range(args.cards)])
+                bare = timed([sys.executable, "-c", "pass"], args.runs)
+                floor = timed([sys.executable, "-c", "import "+", ".join(FLOOR)], args.runs)
+                limit = args.limit * (floor-bare)
+                print("interpreter : {:.1f} ms, floor : {:.1f} ms (+{:.1f}), limit : +{:.1f} ms above it".format(
+                        bare, floor, floor-bare, limit))
+                # stats decodes every card, so its time depends on the collection more than on the start
+                for command, limited in ((["count"], True), (["export", "-o", str(tmp/"list.csv")], True), (["stats"], False)) :
+                        command = [sys.executable, str(pyz), command[0], str(collection)] + command[1:]
+                        ms = timed(command, args.runs)
+                        forbidden = FORBIDDEN + FORBIDDEN_LIMITED*limited
+                        bad = [name for name in imported(command) \
+                                if any(name == f or name.startswith(f+".") for f in forbidden)]
+                        print("{:8} : {:.1f} ms (+{:.1f})".format(command[2], ms, ms-floor), *bad)
+                        failed = failed or (limited and ms-floor > limit) or bad
+        exit(1 if failed else 0)
@@ -1,16 +1,33 @@
 #!/usr/bin/env python3.7
 
-import zipapp, pathlib
+import zipapp, pathlib, shutil, py_compile, tempfile
 
 def pathfilter(path):
     path = pathlib.Path(path)
-    if path.name in ("__main__.py", "back.jpeg") :
+    if path.name == "back.jpeg" :
+        return True
+    if path.suffix == ".py" and path.name != "build.py" and len(path.parts) == 1 :
         return True
     return False
 
 here = pathlib.Path(__file__)
-zipapp.create_archive(here.parent,
-                      interpreter="/usr/bin/env python3",
-                      target=here.parent.parent/"MTG.pyz",
-                      filter=pathfilter,
-                      compressed=True)
+
+def build(target=here.parent.parent/"MTG.pyz"):
+    # the modules are stored compiled too, next to their source (where zipimport
+    # looks for them), so that they're not compiled again at each start ;
+    # a Python of another version just compiles the sources, as before
+    with tempfile.TemporaryDirectory() as staging :
+        staging = pathlib.Path(staging)
+        for path in here.parent.iterdir() :
+            if pathfilter(path.relative_to(here.parent)) :
+                shutil.copy2(str(path), str(staging/path.name))
+                if path.suffix == ".py" :
+                    py_compile.compile(str(staging/path.name), cfile=str(staging/(path.stem+".pyc")),
+                                       dfile=str(pathlib.Path(target)/path.name), doraise=True)
+        zipapp.create_archive(staging,
+                              interpreter="/usr/bin/env python3",
+                              target=target,
+                              compressed=True)
+
+if __name__ == "__main__":
+    build()
@@ -0,0 +1,193 @@
+"""Virtual list widget, showing long lists of cards without slowing Tk down"""
+
+import difflib
+import tkinter
+
+import instrument
+
+
+OVERSCAN = 20 # rows materialized above and below the visible ones
+
+
+class VirtualList(tkinter.Frame) :
+        """Scrolled list of items, of which only the visible rows (plus OVERSCAN
+        rows on each side) are materialized in the inner Listbox, with labels
+        computed by label(item) when they're shown.
+        When the items change, only the materialized rows that differ
+        are inserted, removed or moved.
+        The indexes taken and returned by the methods are those of the items ;
+        like a Listbox in browse mode, at most one of them is selected at once,
+        and <<ListboxSelect>> is generated when the user changes the selection."""
+
+        def __init__(self, master, label, **kwargs):
+                super().__init__(master)
+                self.label = label
+                self.items = list()
+                self.rendered = list() # labels of the materialized rows
+                self.first = 0 # index of the item of the first materialized row
+                self.top = 0 # index of the item of the first visible row
+                self.selected = None # index of the selected item
+                self.listbox = tkinter.Listbox(self, exportselection=False, activestyle="none",
+                        yscrollcommand=self._scrolled, **kwargs)
+                self.scrollbar = tkinter.Scrollbar(self, orient="vertical", command=self.yview)
+                self.listbox.pack(side="left", fill="both", expand=True)
+                self.scrollbar.pack(side="right", fill="y")
+                self.listbox.bind("<<ListboxSelect>>", self._clicked)
+                self.listbox.bind("<Configure>", lambda event:self._render())
+                for sequence, delta in (("<Up>", -1), ("<Down>", 1)) :
+                        self.listbox.bind(sequence, lambda event, delta=delta:self._move(delta))
+                for sequence, delta in (("<Prior>", -1), ("<Next>", 1)) :
+                        self.listbox.bind(sequence, lambda event, delta=delta:self._move(delta*self.visible()))
+                self.listbox.bind("<MouseWheel>", lambda event:self._wheel(-1 if event.delta > 0 else 1))
+                self.listbox.bind("<Button-4>", lambda event:self._wheel(-1))
+                self.listbox.bind("<Button-5>", lambda event:self._wheel(1))
+
+        def __len__(self):
+                return len(self.items)
+
+        # the items
+
+        def set_items(self, items):
+                """Replaces the items ; the selected one stays selected if it's still there"""
+                selected = self.items[self.selected] if self.selected is not None else None
+                self.items = list(items)
+                self.selected = None
+                if selected is not None :
+                        for i, item in enumerate(self.items) :
+                                if item is selected :
+                                        self.selected = i
+                                        break
+                self.top = min(self.top, self._maxtop())
+                self._render()
+
+        def insert(self, index, item):
+                self.items.insert(index, item)
+                if index < self.top :
+                        self.top += 1 # the visible rows don't move
+                if self.selected is not None and index <= self.selected :
+                        self.selected += 1
+                self._render()
+
+        def delete(self, index):
+                del self.items[index]
+                if index < self.top :
+                        self.top -= 1
+                if self.selected == index :
+                        self.selected = None
+                elif self.selected is not None and index < self.selected :
+                        self.selected -= 1
+                self.top = min(self.top, self._maxtop())
+                self._render()
+
+        def refresh(self, index):
+                """To be called when the label of the item at index changed"""
+                self._render()
+
+        # the selection
+
+        def curselection(self):
+                return () if self.selected is None else (self.selected,)
+
+        def selection_set(self, index):
+                self.selected = index
+                self.see(index)
+
+        select_set = selection_set
+
+        def selection_clear(self, *dummy_args):
+                self.selected = None
+                self._render()
+
+        def see(self, index):
+                """Scrolls so that the item at index is visible"""
+                if index < self.top :
+                        self.top = index
+                elif index >= self.top + self.visible() :
+                        self.top = index - self.visible() + 1
+                self.top = max(0, min(self.top, self._maxtop()))
+                self._render()
+
+        # scrolling
+
+        def visible(self):
+                """Number of rows that fit in the inner Listbox"""
+                height = self.listbox.winfo_height()
+                if height <= 1 : # not mapped yet
+                        return int(self.listbox.cget("height"))
+                bbox = self.listbox.bbox(0)
+                rowheight = bbox[3] + 1 if bbox else 16
+                return max(1, height // rowheight)
+
+        def _maxtop(self):
+                return max(0, len(self.items) - self.visible())
+
+        def yview(self, *args):
+                """Command of the scrollbar"""
+                if args[0] == "moveto" :
+                        self.top = int(float(args[1]) * len(self.items))
+                elif args[0] == "scroll" :
+                        step = self.visible() if args[2] == "pages" else 1
+                        self.top += int(args[1]) * step
+                self.top = max(0, min(self.top, self._maxtop()))
+                self._render()
+
+        def _wheel(self, delta):
+                self.yview("scroll", delta*3, "units")
+                return "break"
+
+        def _scrolled(self, *dummy_args):
+                """Called by the inner Listbox when it scrolled by itself
+                (dragging the selection, for instance)"""
+                top = self.first + self.listbox.nearest(0)
+                if top != self.top and self.rendered :
+                        self.top = top
+                        self.after_idle(self._render)
+                self._update_scrollbar()
+
+        def _update_scrollbar(self):
+                if self.items :
+                        self.scrollbar.set(self.top/len(self.items), min(1, (self.top+self.visible())/len(self.items)))
+                else :
+                        self.scrollbar.set(0, 1)
+
+        # events
+
+        def _clicked(self, event):
+                rows = self.listbox.curselection()
+                self.selected = self.first + rows[0] if rows else None
+
+        def _move(self, delta):
+                if not self.items :
+                        return "break"
+                index = 0 if self.selected is None else self.selected + delta
+                self.selection_set(max(0, min(index, len(self.items)-1)))
+                self.listbox.event_generate("<<ListboxSelect>>")
+                return "break"
+
+        # rendering
+
+        @instrument.timed("ui.render")
+        def _render(self):
+                """Materializes the rows around the visible ones, touching only those that changed"""
+                visible = self.visible()
+                count = visible + 2*OVERSCAN
+                if not (self.first <= self.top and self.top + visible <= self.first + len(self.rendered)) \
+                                or len(self.rendered) < min(count, len(self.items) - self.first) :
+                        self.first = max(0, self.top - OVERSCAN)
+                labels = [self.label(item) for item in self.items[self.first:self.first+count]]
+                if labels != self.rendered :
+                        matcher = difflib.SequenceMatcher(None, self.rendered, labels, autojunk=False)
+                        # applied from the end, so that the indexes of the opcodes stay valid
+                        for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()) :
+                                if tag == "equal" :
+                                        continue
+                                if i2 > i1 :
+                                        self.listbox.delete(i1, i2-1)
+                                if j2 > j1 :
+                                        self.listbox.insert(i1, *labels[j1:j2])
+                        self.rendered = labels
+                self.listbox.selection_clear(0, "end")
+                if self.selected is not None and self.first <= self.selected < self.first + len(labels) :
+                        self.listbox.selection_set(self.selected - self.first)
+                self.listbox.yview(self.top - self.first)
+                self._update_scrollbar()
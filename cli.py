@@ -0,0 +1,200 @@
+"""Command line tools working on collection files, without user interface.
+They only load what they need (see core), so that they start quickly"""
+
+import argparse, contextlib, pathlib, sys
+
+from core import parse_id, read_ids, import_ids, add_card, go_offline, \
+        load_collection, load_amounts, save_collection, merge_files
+from collection import diff as diff_amounts
+from sortkeys import number_key
+
+
+GROUP_NAMES = {
+        "rarity":"par rareté",
+        "cmc":"par coût",
+        "type":"par type",
+        "color":"par couleur",
+        "set":"par édition",
+        "completion":"éditions complétées (celles du miroir local seulement)"}
+
+
+def card_id(key):
+        """The identifier of the card of key (its set and number),
+        as printed in the bottom left corner of the cards"""
+        return "".join(key)
+
+def ids(parser, values):
+        """Parses the card identifiers values, or exits if one is malformed"""
+        parsed = [parse_id(value) for value in values]
+        bad = [value for value, id in zip(values, parsed) if id is None]
+        if bad :
+                parser.error("malformed identifiers : " + " ".join(bad))
+        return parsed
+
+
+def add(parser, args):
+        cards, collection = load_collection(args.file)
+        missing = list()
+        for (code, number), value in zip(ids(parser, args.ids), args.ids) :
+                if add_card(cards, code, number, args.amount) is None :
+                        missing.append(value)
+        save_collection(args.file, cards, collection)
+        if missing :
+                print("introuvables :", *missing, file=sys.stderr)
+                return 1
+        return 0
+
+def count(parser, args):
+        amounts = load_amounts(args.file)
+        if not args.ids :
+                print(sum(amounts.values()))
+                return 0
+        for (code, number), value in zip(ids(parser, args.ids), args.ids) :
+                print(value, amounts.get((code, number)) or amounts.get((code, number+"a"), 0)) # maybe it's a flip card
+        return 0
+
+def import_(parser, args):
+        with open(args.list) as file :
+                ids, errors = read_ids(file)
+        if errors :
+                parser.error("malformed lines in {} : {}".format(args.list, ", ".join(map(str, errors))))
+        cards, collection = load_collection(args.file)
+        found, missing = import_ids(ids)
+        for card, amount in found :
+                cards.add(card, amount)
+        save_collection(args.file, cards, collection)
+        print(sum(amount for card, amount in found), "cartes ajoutées")
+        if missing :
+                print("introuvables :", *missing)
+        return 0
+
+def export(parser, args):
+        """Writes the cards as a list that import reads back"""
+        amounts = load_amounts(args.file)
+        with contextlib.nullcontext(sys.stdout) if args.output is None else open(args.output, "w") as out : # sys.stdout stays open
+                for key in sorted(amounts, key=lambda key:(key[0], number_key(key[1]))) :
+                        print(card_id(key), amounts[key], sep=",", file=out)
+        return 0
+
+def existing(parser, paths):
+        """Exits if one of the files at paths doesn't exist"""
+        missing = [str(path) for path in paths if not path.exists()]
+        if missing :
+                parser.error("no such files : " + " ".join(missing))
+
+def merge(parser, args):
+        existing(parser, args.files + args.subtract)
+        amounts = merge_files(args.output, args.files, args.subtract)
+        print(sum(amounts.values()), "cartes ({} différentes) écrites dans {}".format(len(amounts), args.output))
+        return 0
+
+def diff(parser, args):
+        """Lists the cards whose amount changed from old to new"""
+        existing(parser, [args.old, args.new])
+        changed = diff_amounts(load_amounts(args.old), load_amounts(args.new))
+        with contextlib.nullcontext(sys.stdout) if args.output is None else open(args.output, "w") as out : # sys.stdout stays open
+                for key, before, after in sorted(changed, key=lambda x:(x[0][0], number_key(x[0][1]))) :
+                        print(card_id(key), before, after, "{:+d}".format(after-before), sep=",", file=out)
+        print(sum(max(0, after-before) for key, before, after in changed), "cartes en plus,",
+                sum(max(0, before-after) for key, before, after in changed), "en moins", file=sys.stderr)
+        return 0
+
+def stats(parser, args):
+        try :
+                from columns import Columns, FIELDS, CURVE_MAX, COLORS, COLORLESS, MULTICOLOR
+        except ModuleNotFoundError as e :
+                parser.error("stats needs {}".format(e.name))
+        where = dict()
+        for filter in args.where :
+                field, sep, value = filter.partition("=")
+                if not sep or field not in FIELDS :
+                        parser.error("malformed filter : {} (FIELD=VALUE, FIELD being one of {})".format(filter, ", ".join(FIELDS)))
+                if field == "cmc" and not value.rstrip("+").isdigit() :
+                        parser.error("malformed filter : {} (cmc being a number, {}+ for {} and more)".format(filter, CURVE_MAX, CURVE_MAX))
+                if field == "color" :
+                        colors = {c.lower():c for c in COLORS + [COLORLESS, MULTICOLOR]}
+                        if value.lower() not in colors :
+                                parser.error("malformed filter : {} (color being one of {})".format(filter, ", ".join(colors.values())))
+                        value = colors[value.lower()]
+                where[field] = value.rstrip("+") if field == "cmc" else value
+        cards, collection = load_collection(args.file)
+        columns = Columns(cards)
+        entries, copies = columns.total(**where)
+        print("cartes :", copies)
+        print("cartes différentes :", entries)
+        print("éditions :", len(columns.group("set", **where)))
+        for by in args.by or ["rarity", "set"] :
+                groups = columns.group(by, **where)
+                print(GROUP_NAMES[by], ":")
+                if by == "set" :
+                        groups = sorted(groups, key=lambda g:(-g[2], g[0]))[:args.top]
+                for value, entries, copies in groups :
+                        if by == "cmc" and value == CURVE_MAX :
+                                value = "{}+".format(value)
+                        print("  {} : {}".format(value if value is not None else "?", copies))
+        if args.completion :
+                from core import Card
+                print(GROUP_NAMES["completion"], ":")
+                for code, owned, size in columns.completion(Card.mirror.set_sizes()) :
+                        print("  {} : {}/{} ({:.0%})".format(code, owned, size, owned/size))
+        return 0
+
+
+COMMANDS = {
+        "add":add,
+        "count":count,
+        "import":import_,
+        "export":export,
+        "merge":merge,
+        "diff":diff,
+        "stats":stats}
+
+
+def main(argv):
+        """Runs the command line tool argv[0] with the arguments argv[1:],
+        and returns the exit status"""
+        parser = argparse.ArgumentParser(prog="MTG.pyz")
+        commands = parser.add_subparsers(dest="command")
+        p = commands.add_parser("add", help="add cards to a collection file, created if needed")
+        p.add_argument("file", type=pathlib.Path)
+        p.add_argument("ids", nargs="+", metavar="ID", help="SET+number, as printed on the card")
+        p.add_argument("-n", "--amount", type=int, default=1, help="copies of each card to add")
+        p.add_argument("--offline", action="store_true", help="never query the remote API, use the responses cached before")
+        p = commands.add_parser("count", help="print the number of cards of a collection file, or the amount of each card given")
+        p.add_argument("file", type=pathlib.Path)
+        p.add_argument("ids", nargs="*", metavar="ID")
+        p = commands.add_parser("import", help="add the cards listed in LIST (one SET+number[,amount] per line) to a collection file, created if needed")
+        p.add_argument("file", type=pathlib.Path)
+        p.add_argument("list", type=pathlib.Path)
+        p.add_argument("--offline", action="store_true", help="never query the remote API, use the responses cached before")
+        p = commands.add_parser("export", help="list the cards of a collection file, in the format of import")
+        p.add_argument("file", type=pathlib.Path)
+        p.add_argument("-o", "--output", type=pathlib.Path, help="file to write (the standard output by default)")
+        p = commands.add_parser("merge", help="write the cards of several collection files to a new one, adding their amounts")
+        p.add_argument("output", type=pathlib.Path, help="file to write (replaced if it exists)")
+        p.add_argument("files", nargs="+", type=pathlib.Path, metavar="FILE")
+        p.add_argument("-s", "--subtract", nargs="+", type=pathlib.Path, default=list(), metavar="FILE",
+                help="subtract the amounts of these files (the cards left with none are dropped)")
+        p = commands.add_parser("diff", help="list the cards whose amount differs between two collection files, as SET+number,old,new,change")
+        p.add_argument("old", type=pathlib.Path)
+        p.add_argument("new", type=pathlib.Path)
+        p.add_argument("-o", "--output", type=pathlib.Path, help="file to write (the standard output by default)")
+        p = commands.add_parser("stats", help="print statistics on a collection file")
+        p.add_argument("file", type=pathlib.Path)
+        p.add_argument("--top", type=int, default=10, metavar="N", help="sets listed")
+        p.add_argument("--by", action="append", choices=["rarity", "cmc", "type", "color", "set"],
+                help="group the cards by this field (may be repeated ; rarity and set by default)")
+        p.add_argument("--where", action="append", default=list(), metavar="FIELD=VALUE",
+                help="count only the cards whose FIELD (one of those of --by) is VALUE (for type and color : which have it)")
+        p.add_argument("--completion", action="store_true", help="print the share of the cards of each set owned (for the sets downloaded to the local mirror only)")
+        args = parser.parse_args(argv)
+        if getattr(args, "offline", False) :
+                go_offline()
+        try :
+                return COMMANDS[args.command](parser, args)
+        except ConnectionError as e :
+                from httpcache import Offline
+                if not isinstance(e, Offline) : # a broken pipe, for instance
+                        raise
+                print("hors ligne :", e, file=sys.stderr)
+                return 2
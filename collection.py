@@ -0,0 +1,263 @@
+"""Collection files.
+A collection file is a header, followed by records : a side table holding
+the metadata of each card (its raw API data, stored once whatever the
+changes of its amount) and of the other half of the flip cards, then
+the amount of each card.
+Saving again only appends the records of the amounts that changed (and
+the metadata of the new cards) : that's the journal, replayed when the
+file is read. Once the journal is too long, the file is rewritten from
+scratch (a checkpoint).
+The files are read and written one record at a time."""
+
+import os, json, zlib, struct
+
+import instrument
+
+
+MAGIC = b"MTGC"
+VERSION = 1
+HEADER = MAGIC + bytes([VERSION])
+FRAME = struct.Struct("<cI") # kind of the record, length of its payload
+KEYLEN = struct.Struct("<H")
+AMOUNT_VALUE = struct.Struct("<i")
+METADATA = b"M" # payload : key, then the raw data of the card as zlib-compressed JSON
+AMOUNT = b"A" # payload : key, then the amount of the card (0 once it's removed)
+TWIN = b"T" # payload : key, then the metadata of the other half of that flip card (see Card.twin)
+CHECKPOINT_MIN = 256 # journal records always allowed before a checkpoint
+
+
+def card_key(card):
+        return (card.set, card.number)
+
+def is_collection(head):
+        """True if head, the first bytes of a file, are those of a collection file
+        (rather than of a pickle, the former format)"""
+        return head.startswith(MAGIC)
+
+
+def _record(kind, key, value):
+        key = "\0".join(key).encode()
+        payload = KEYLEN.pack(len(key)) + key + value
+        return FRAME.pack(kind, len(payload)) + payload
+
+def encode(raw):
+        """The metadata of a card, from its raw data"""
+        return zlib.compress(json.dumps(raw).encode())
+
+def decode(metadata):
+        """The raw data of a card, from its metadata"""
+        return json.loads(zlib.decompress(metadata).decode())
+
+def _metadata(card, metadata):
+        return _record(METADATA, card_key(card), metadata(card))
+
+def _twin(card, metadata):
+        return _record(TWIN, card_key(card), metadata(card.twin))
+
+def has_twin(card):
+        return getattr(card, "twin", None) is not None
+
+def _amount(key, amount):
+        return _record(AMOUNT, key, AMOUNT_VALUE.pack(amount))
+
+
+def read_records(file):
+        """Yields the (kind, key, value) records of file, positioned after the header.
+        A torn last record (a crash while appending) is ignored,
+        as are the records of unknown kinds (from newer versions)"""
+        while True :
+                frame = file.read(FRAME.size)
+                if len(frame) < FRAME.size :
+                        return
+                kind, length = FRAME.unpack(frame)
+                payload = file.read(length)
+                if len(payload) < length :
+                        return
+                keylen, = KEYLEN.unpack_from(payload)
+                key = tuple(payload[KEYLEN.size:KEYLEN.size+keylen].decode().split("\0"))
+                value = payload[KEYLEN.size+keylen:]
+                if kind == AMOUNT :
+                        yield kind, key, AMOUNT_VALUE.unpack(value)[0]
+                elif kind in (METADATA, TWIN) :
+                        yield kind, key, value # decompressed only if the card is still there in the end
+
+
+class CollectionFile :
+        """A collection file, as last saved. Use load or create to get one."""
+
+        def __init__(self, path, amounts, records, end, twins=()):
+                self.path = path
+                self.amounts = amounts # key -> amount saved ; the keys are those with metadata in the file
+                self.twins = set(twins) # keys of the cards whose twin is saved
+                self.journal = max(0, records - 2*len(amounts) - len(self.twins)) # records beyond those of a checkpoint
+                self.end = end # end of the last whole record : a torn one after it is overwritten
+
+        @classmethod
+        def load(cls, file, factory=None):
+                """Reads the collection file file (positioned after the header), and
+                returns the CollectionFile and the list of the cards built by factory
+                from their metadata (None if there's no factory : the amounts
+                are in the CollectionFile then). The flip cards get their twin back"""
+                metadata, amounts, twins, records = dict(), dict(), dict(), 0
+                end = file.tell()
+                for kind, key, value in read_records(file) :
+                        records += 1
+                        end = file.tell()
+                        if kind == METADATA :
+                                metadata[key] = value
+                                amounts.setdefault(key, 0)
+                        elif kind == TWIN :
+                                twins[key] = value
+                        else :
+                                amounts[key] = value
+                cards = None
+                if factory is not None :
+                        cards = list()
+                        for key, amount in amounts.items() :
+                                if amount > 0 and key in metadata :
+                                        card = factory(metadata[key])
+                                        card.amount = amount
+                                        if key in twins :
+                                                card.twin = factory(twins[key])
+                                                card.twin.twin = card
+                                        cards.append(card)
+                amounts = {key:amount for key, amount in amounts.items() if key in metadata}
+                return cls(file.name, amounts, records, end, (key for key in twins if key in metadata)), cards
+
+        @classmethod
+        def create(cls, path, cards, metadata):
+                """Writes cards to a new collection file at path (replacing it
+                atomically if it exists), metadata giving the metadata of a card
+                (see encode), and returns the CollectionFile"""
+                self = cls(path, dict(), 0, 0)
+                self.checkpoint(cards, metadata)
+                return self
+
+        @instrument.timed("io.checkpoint")
+        def checkpoint(self, cards, metadata):
+                """Rewrites the whole file, without journal"""
+                self.amounts = replace(self.path, lambda file:write_collection(file, cards, metadata))
+                self.twins = {card_key(card) for card in cards if has_twin(card)}
+                self.journal = 0
+                self.end = os.path.getsize(self.path)
+
+        def changes(self, cards):
+                """Returns the cards whose amount changed since the last save,
+                and the keys of the cards removed since"""
+                changed, present = list(), set()
+                for card in cards :
+                        key = card_key(card)
+                        present.add(key)
+                        if self.amounts.get(key) != card.amount :
+                                changed.append(card)
+                removed = [key for key, amount in self.amounts.items() if amount and key not in present]
+                return changed, removed
+
+        @instrument.timed("io.save")
+        def save(self, cards, metadata):
+                """Saves cards : appends the changes since the last save to the journal,
+                or rewrites the whole file if the journal grew too long.
+                Returns the number of bytes written"""
+                cards = list(cards)
+                changed, removed = self.changes(cards)
+                # the twins looked up since the last save (see Card.localized_name)
+                twins = [card for card in cards if has_twin(card) and card_key(card) not in self.twins]
+                if not changed and not removed and not twins :
+                        return 0
+                if self.journal + len(changed) + len(removed) + len(twins) > max(CHECKPOINT_MIN, len(cards)//2) :
+                        self.checkpoint(cards, metadata)
+                        return os.path.getsize(self.path)
+                data = list()
+                for card in changed :
+                        key = card_key(card)
+                        if key not in self.amounts :
+                                data.append(_metadata(card, metadata))
+                        data.append(_amount(key, card.amount))
+                        self.amounts[key] = card.amount
+                for key in removed :
+                        data.append(_amount(key, 0))
+                        self.amounts[key] = 0
+                for card in twins :
+                        data.append(_twin(card, metadata))
+                        self.twins.add(card_key(card))
+                data = b"".join(data)
+                with open(self.path, "r+b") as file :
+                        file.seek(self.end)
+                        file.write(data)
+                        file.truncate()
+                        file.flush()
+                        os.fsync(file.fileno())
+                self.journal += len(changed) + len(removed) + len(twins)
+                self.end += len(data)
+                return len(data)
+
+
+def replace(path, write):
+        """Calls write with a new file, which then replaces the file at path atomically.
+        Returns what write returns"""
+        tmp = str(path) + ".tmp"
+        with open(tmp, "wb") as file :
+                result = write(file)
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(tmp, path)
+        return result
+
+def write_collection(file, cards, metadata):
+        """Writes cards to file as a collection file without journal, metadata
+        giving the metadata of a card. Returns the amounts written, by key"""
+        file.write(HEADER)
+        amounts = dict()
+        for card in cards : # the side table first,
+                file.write(_metadata(card, metadata))
+                if has_twin(card) :
+                        file.write(_twin(card, metadata))
+                amounts[card_key(card)] = card.amount
+        for key, amount in amounts.items() : # then the amounts
+                file.write(_amount(key, amount))
+        return amounts
+
+def write_contents(file, amounts, metadata, twins=dict()):
+        """Writes the cards whose amounts and metadata (and those of their twins,
+        for the flip cards) are given by key to file, as a collection file without journal"""
+        file.write(HEADER)
+        for key in amounts :
+                file.write(_record(METADATA, key, metadata[key]))
+                if key in twins :
+                        file.write(_record(TWIN, key, twins[key]))
+        for key, amount in amounts.items() :
+                file.write(_amount(key, amount))
+
+
+def merge(sources):
+        """Sums the amounts of the cards of sources, an iterable of (records, sign),
+        records being the records of a collection file (see read_records),
+        sign being 1 to add its amounts, -1 to subtract them. The records are
+        read one at a time : only the totals and the metadata of each card
+        (once) are kept, whatever the size and the number of the files.
+        Returns the amounts, the metadata and the metadata of the twins
+        of the cards whose total is positive, by key"""
+        totals, kept, twins = dict(), dict(), dict()
+        for records, sign in sources :
+                amounts = dict() # of this file : the last record of each card counts
+                for kind, key, value in records :
+                        if kind == METADATA :
+                                if sign > 0 and key not in kept :
+                                        kept[key] = value
+                                amounts.setdefault(key, 0)
+                        elif kind == TWIN :
+                                if sign > 0 :
+                                        twins.setdefault(key, value)
+                        else :
+                                amounts[key] = value
+                for key, amount in amounts.items() :
+                        totals[key] = totals.get(key, 0) + sign*amount
+        amounts = {key:amount for key, amount in totals.items() if amount > 0 and key in kept}
+        return amounts, {key:kept[key] for key in amounts}, {key:twins[key] for key in amounts if key in twins}
+
+def diff(old, new):
+        """Returns the list of the (key, amount in old, amount in new) of the cards
+        whose amount differs between old and new, amounts by key"""
+        changed = [(key, amount, new.get(key, 0)) for key, amount in old.items() if new.get(key, 0) != amount]
+        changed.extend((key, 0, amount) for key, amount in new.items() if key not in old)
+        return changed
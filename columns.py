@@ -0,0 +1,183 @@
+"""Columnar view of the cards, for the statistics of the collection : the
+fields they're grouped by are kept as NumPy arrays, one row per card,
+so that the aggregates are computed at C speed whatever the size."""
+
+import numpy
+
+from core import RARITY
+
+
+CAPACITY = 1024 # rows allocated at first ; doubled when they're all used
+COLORS = ["White", "Blue", "Black", "Red", "Green"]
+COLORLESS = "Colorless"
+MULTICOLOR = "Multicolor"
+CURVE_MAX = 7 # mana values from which the cards are counted together
+FIELDS = ["rarity", "cmc", "type", "color", "set"] # what the cards may be grouped by
+COLUMNS = { # name -> type of the array
+        "amount":numpy.int64,
+        "cmc":numpy.float64,
+        "rarity":numpy.int8, # index in Columns.rarities
+        "set":numpy.int32, # index in Columns.codes
+        "types":numpy.uint64, # bit i : the card has the type Columns.typenames[i]
+        "colors":numpy.uint8} # bit i : the card has the color COLORS[i]
+
+
+class Columns :
+        """The columns of cards, kept up to date with add, discard and refresh.
+        Each change costs O(1) : a removed card's row is replaced by the last one.
+        The cards are told apart by identity, since they aren't hashable."""
+
+        def __init__(self, cards=()):
+                self.codes = list() # set codes, in the order they were met
+                self.typenames = list() # types, idem
+                self.rarities = list(RARITY) # idem, after the known ones
+                self._indexes = {"codes":dict(), "typenames":dict(),
+                        "rarities":{r:i for i, r in enumerate(RARITY)}} # value -> index in each of them
+                self.sync(cards)
+
+        def __len__(self):
+                return len(self.cards)
+
+        def __contains__(self, card):
+                return id(card) in self.rows
+
+        def _index(self, vocabulary, value):
+                indexes = self._indexes[vocabulary]
+                index = indexes.get(value)
+                if index is None :
+                        index = indexes[value] = len(indexes)
+                        getattr(self, vocabulary).append(value)
+                return index
+
+        def _row(self, card):
+                """The values of the columns for card"""
+                types = 0
+                for t in card.types or () :
+                        types |= 1 << self._index("typenames", t)
+                colors = 0
+                for c in card.colors or () :
+                        if c in COLORS :
+                                colors |= 1 << COLORS.index(c)
+                return (card.amount, card.cmc or 0, self._index("rarities", card.rarity),
+                        self._index("codes", card.set), types, colors)
+
+        def sync(self, cards):
+                """Makes the columns hold cards, and only them"""
+                self.cards = list(cards)
+                self.rows = {id(card):i for i, card in enumerate(self.cards)} # id(card) -> row
+                rows = [self._row(card) for card in self.cards]
+                capacity = max(CAPACITY, 2*len(rows))
+                for name, values in zip(COLUMNS, zip(*rows) if rows else [()]*len(COLUMNS)) :
+                        column = numpy.zeros(capacity, COLUMNS[name])
+                        column[:len(rows)] = values
+                        setattr(self, name, column)
+
+        def _set(self, i, card):
+                for name, value in zip(COLUMNS, self._row(card)) :
+                        getattr(self, name)[i] = value
+
+        def add(self, card):
+                if id(card) in self.rows :
+                        return
+                i = len(self.cards)
+                if i == len(self.amount) :
+                        for name in COLUMNS :
+                                setattr(self, name, numpy.concatenate((getattr(self, name), numpy.zeros_like(getattr(self, name)))))
+                self.cards.append(card)
+                self.rows[id(card)] = i
+                self._set(i, card)
+
+        def discard(self, card):
+                i = self.rows.pop(id(card), None)
+                if i is None :
+                        return
+                last = self.cards.pop()
+                if last is not card : # the last row takes its place
+                        self.cards[i] = last
+                        self.rows[id(last)] = i
+                        for name in COLUMNS :
+                                column = getattr(self, name)
+                                column[i] = column[len(self.cards)]
+
+        def refresh(self, card):
+                """To be called when card changed (its amount, usually)"""
+                i = self.rows.get(id(card))
+                if i is not None :
+                        self._set(i, card)
+
+        def mask(self, field, value):
+                """The boolean array of the rows whose field (see FIELDS) is value
+                (for type and color : have that type, or color)"""
+                n = len(self.cards)
+                if field in ("rarity", "set") :
+                        index = self._indexes["rarities" if field == "rarity" else "codes"].get(value)
+                        column = self.rarity if field == "rarity" else self.set
+                        return column[:n] == index if index is not None else numpy.zeros(n, bool)
+                elif field == "cmc" :
+                        return numpy.minimum(self.cmc[:n], CURVE_MAX).astype(int) == int(value)
+                elif field == "type" :
+                        index = self._indexes["typenames"].get(value)
+                        return self.types[:n] & numpy.uint64(1 << index) != 0 if index is not None else numpy.zeros(n, bool)
+                elif field == "color" :
+                        if value == COLORLESS :
+                                return self.colors[:n] == 0
+                        if value == MULTICOLOR :
+                                return self.colors[:n] & (self.colors[:n]-1) != 0 # more than one bit
+                        return self.colors[:n] & (1 << COLORS.index(value)) != 0
+                raise ValueError("No such field : "+field)
+
+        def total(self, **where):
+                """Returns the number of cards, and of copies, passing the filters where
+                (field=value, see mask)"""
+                selected = self.select(where)
+                amount = self.amount[:len(self.cards)]
+                if selected is None :
+                        return len(self.cards), int(amount.sum())
+                return int(numpy.count_nonzero(selected)), int(amount[selected].sum())
+
+        def select(self, where):
+                """The boolean array of the rows passing all the filters where, or None if there's none"""
+                selected = None
+                for field, value in where.items() :
+                        m = self.mask(field, value)
+                        selected = m if selected is None else selected & m
+                return selected
+
+        def group(self, by, **where):
+                """Returns the list of the (value, cards, copies) of the cards passing
+                the filters where (see total), grouped by the field by (see FIELDS)
+                ; the values without cards are left out.
+                The cards having several types or colors are counted in each group"""
+                n = len(self.cards)
+                selected = self.select(where)
+                weights = self.amount[:n] if selected is None else self.amount[:n] * selected
+                present = numpy.ones(n, numpy.int64) if selected is None else selected.astype(numpy.int64)
+                def counted(codes, labels):
+                        cards = numpy.bincount(codes, present, minlength=len(labels))
+                        copies = numpy.bincount(codes, weights, minlength=len(labels))
+                        return [(label, int(c), int(a)) for label, c, a in zip(labels, cards, copies) if c]
+                if by == "rarity" :
+                        return counted(self.rarity[:n], self.rarities)
+                elif by == "cmc" :
+                        codes = numpy.minimum(self.cmc[:n], CURVE_MAX).astype(numpy.intp)
+                        return counted(codes, list(range(CURVE_MAX+1)))
+                elif by == "set" :
+                        return counted(self.set[:n], self.codes)
+                elif by in ("type", "color") :
+                        values = self.typenames if by == "type" else COLORS + [COLORLESS, MULTICOLOR]
+                        groups = list()
+                        for value in values :
+                                m = self.mask(by, value)
+                                cards = int(numpy.count_nonzero(m & (present != 0)))
+                                if cards :
+                                        groups.append((value, cards, int(weights[m].sum())))
+                        return groups
+                raise ValueError("No such field : "+by)
+
+        def completion(self, sizes):
+                """Returns the list of the (set code, cards owned, cards in the set)
+                of the sets whose size is known (sizes : set code -> number of cards),
+                the most complete first"""
+                owned = numpy.bincount(self.set[:len(self.cards)], minlength=len(self.codes))
+                found = [(code, int(owned[i]), sizes[code]) for i, code in enumerate(self.codes) if code in sizes and owned[i]]
+                return sorted(found, key=lambda x:(-x[1]/x[2], x[0]))
@@ -0,0 +1,533 @@
+"""The cards and the collections, without user interface.
+Loading this module is cheap : mtgsdk (and urllib), PIL, the images cache,
+the fetcher, the local mirror and the responses cache are only loaded when first needed,
+so that the command line tools start quickly."""
+
+import re, sys, zlib, pathlib, threading
+
+import instrument
+from inventory import Inventory
+from collection import CollectionFile, HEADER, METADATA, AMOUNT, TWIN, is_collection, write_collection, \
+        encode, decode, read_records, write_contents, replace, merge
+
+
+LANG = "French" # of the names and pictures of the cards, see set_language
+LANGUAGES = ["English", "French", "German", "Italian", "Spanish", "Portuguese (Brazil)",
+        "Japanese", "Korean", "Russian", "Chinese Simplified", "Chinese Traditional"] # those of the API
+LEGACY_LANG = "French" # of the pictures the former versions cached, keyed by the multiverseid alone
+RARITY = [
+        "Mythic Rare",
+        "Rare",
+        "Uncommon",
+        "Common",
+        "Basic Land"]
+IMPORT_WORKERS = 8 # sets downloaded at once by import_ids
+CARD_ID = re.compile("(?P<code>p?[A-Za-z][A-Za-z0-9]{2})(?P<number>[0-9]{1,3}(a|b)?)")
+HERE = pathlib.Path(__file__).parent # the zipapp, or the directory of the sources
+CARDS = "cards" # resources of the remote API
+SETS = "sets"
+TTL = {CARDS:7*24*3600, SETS:24*3600} # s the responses of the remote API are fresh for (see httpcache)
+SNAKE_CASE = { # attributes set by mtgsdk.Card, whose name differs from the key of the API
+        "mana_cost":"manaCost",
+        "color_identity":"colorIdentity",
+        "multiverse_id":"multiverseid",
+        "release_date":"releaseDate",
+        "original_text":"originalText",
+        "original_type":"originalType",
+        "image_url":"imageUrl",
+        "set_name":"setName",
+        "foreign_names":"foreignNames"}
+SAME_CASE = ["name", "layout", "cmc", "colors", "names", "type", "supertypes", "subtypes",
+        "types", "rarity", "text", "flavor", "artist", "number", "power", "toughness",
+        "loyalty", "variations", "watermark", "border", "timeshifted", "hand", "life",
+        "starter", "printings", "source", "set", "id", "legalities", "rulings"]
+HOT = ("name", "set", "number", "multiverseid", "cmc", "colors", "type", "types", "rarity", "text", "watermark") # kept decoded by Card
+NO_NAMES = dict() # the names in the other languages of the cards having none, shared (never changed)
+INTERNED = dict() # the tuples Card shares, as sys.intern does for the strings
+
+
+def list_sets():
+        """Returns the (name, code) of the sets, the last released first.
+        The list is downloaded again once it's older than TTL[SETS] (see httpcache) ;
+        without network, and never downloaded, it's the one in the mirror"""
+        try :
+                sets = sync_sets()
+        except OSError :
+                sets = Card.mirror.sets()
+                if not sets :
+                        raise
+        vals = [(s["name"], s["code"]) for s in sorted(sets, key=lambda x:x.get("releaseDate") or "", reverse=True)]
+        return vals
+
+def fetch_raw(resource, params=dict()):
+        """Yields the raw response dicts of the remote API
+        for the query params on resource, paging through the data"""
+        import mtgsdk
+        url = "{}/{}".format(mtgsdk.config.__endpoint__, resource)
+        params = dict(params)
+        fetch_all = "page" not in params
+        params.setdefault("page", 1)
+        while True :
+                response = Card.http.get(url, params, TTL[resource])[resource]
+                yield from response
+                if not response or not fetch_all :
+                        return
+                params["page"] += 1
+
+def sync_sets():
+        """Downloads the list of the sets to the mirror, and returns it"""
+        sets = list(fetch_raw(SETS))
+        Card.mirror.store_sets(sets)
+        return sets
+
+def sync_set(code):
+        """Downloads all the cards of the set code to the mirror,
+        and returns how many they are"""
+        cards = list(fetch_raw(CARDS, dict(set=code)))
+        Card.mirror.store_cards(cards, synced_set=code)
+        return len(cards)
+
+def go_offline():
+        """From now on, the remote API isn't queried : the cached responses
+        are used, even stale ones, and the queries not cached fail (see httpcache)"""
+        Card.http.offline = True
+
+def set_language(language):
+        """Makes language the one the names and pictures of the cards are in.
+        What was computed for the other languages (see SortKeys and FilterIndex)
+        and the pictures cached in them are kept"""
+        global LANG
+        LANG = language
+
+def get_language():
+        return LANG
+
+def picture_key(multiverseid, language):
+        """Key in the images cache of the picture in language of the card of multiverseid"""
+        if language == LEGACY_LANG :
+                return str(multiverseid)
+        return "{}/{}".format(multiverseid, language)
+
+def parse_id(resp):
+        """Returns the (set code, number) of the card identifier resp
+        (as printed in the bottom left corner of the cards), or None if it's malformed"""
+        z = CARD_ID.fullmatch(resp)
+        if not z :
+                return None
+        return z.groupdict()["code"].upper(), z.groupdict()["number"].lstrip("0")
+
+def read_ids(file):
+        """Reads a text or CSV file holding one "SET+number[,amount]" card identifier
+        per line. Empty lines and lines starting with # are skipped.
+        Returns the list of the (set code, number, amount), and the list of
+        the numbers of the malformed lines"""
+        import csv
+        ids, errors = list(), list()
+        for i, row in enumerate(csv.reader(file), 1) :
+                row = [x.strip() for x in row]
+                if not row or not row[0] or row[0].startswith("#") :
+                        continue
+                id = parse_id(row[0])
+                amount = row[1] if len(row) > 1 and row[1] else "1"
+                if id is None or len(row) > 2 or not amount.isdigit() or not int(amount) :
+                        errors.append(i)
+                        continue
+                ids.append(id + (int(amount),))
+        return ids, errors
+
+def import_ids(ids):
+        """Looks up the cards of ids, a list of (set code, number, amount), downloading
+        each set at once, several sets at the same time.
+        Returns the list of the (card, amount) found, and the list of
+        the identifiers of the cards not found"""
+        import concurrent.futures
+        bysets = dict()
+        for code, num, amount in ids :
+                bysets.setdefault(code, list()).append((num, amount))
+        def lookup(code):
+                return {card.number:card for card in Card.where(set=code).all()}
+        found, missing = dict(), list()
+        with concurrent.futures.ThreadPoolExecutor(IMPORT_WORKERS) as pool :
+                for code, bynumber in zip(bysets, pool.map(lookup, bysets)) :
+                        for num, amount in bysets[code] :
+                                card = bynumber.get(num) or bynumber.get(num+"a") # maybe it's a flip card
+                                if card is None :
+                                        missing.append(code+num)
+                                elif (card.set, card.number) in found :
+                                        found[card.set, card.number][1] += amount
+                                else :
+                                        found[card.set, card.number] = [card, amount]
+        return [tuple(x) for x in found.values()], missing
+
+def find_stored(cards, code, number):
+        """Returns the card of the Inventory cards with that set code and number, or None"""
+        return cards.get(code, number) or cards.get(code, number+"a") # maybe it's a flip card
+
+def lookup(code, number):
+        """Returns the list of the cards with that set code and number, in LANG"""
+        language = dict(language=LANG) if LANG != "English" else dict() # every card has an English name
+        found = Card.where(set=code, number=number, **language).all()
+        if not found :
+                found = Card.where(set=code, number=number+"a", **language).all() # maybe it's a flip card
+        return found
+
+def add_card(cards, code, number, amount=1):
+        """Adds amount copies of the card with that set code and number to
+        the Inventory cards, looking it up only if it's not stored yet.
+        Returns the card stored, or None if there's no such card"""
+        card = find_stored(cards, code, number)
+        if card is None :
+                found = lookup(code, number)
+                if not found :
+                        return None
+                card = found[0]
+        return cards.add(card, amount)
+
+def write_to_file(file, cards):
+        """Writes cards to file, as a collection file without journal (see collection)"""
+        write_collection(file, cards, Card.metadata)
+
+@instrument.timed("io.load")
+def read_from_file(file):
+        """Returns the Inventory stored in file, and the CollectionFile
+        to save it again incrementally (None if file has the former format)"""
+        head = file.read(len(HEADER))
+        if is_collection(head) :
+                collection, cards = CollectionFile.load(file, Card.from_metadata)
+                return Inventory(cards), collection
+        # former format : a pickled list of cards
+        obj = head + file.read()
+        try :
+                obj = zlib.decompress(obj) # former versions : the data was stored uncompressed
+        except :
+                pass
+        finally :
+                return Inventory(unpickle(obj)), None
+
+def unpickle(data):
+        """Loads the former format : the cards were pickled as __main__.Card"""
+        import pickle, io
+        class Unpickler(pickle.Unpickler) :
+                def find_class(self, module, name):
+                        if (module, name) == ("__main__", "Card") :
+                                return Card
+                        return super().find_class(module, name)
+        return Unpickler(io.BytesIO(data)).load()
+
+def load_collection(path):
+        """Returns the Inventory stored in the file at path, and its CollectionFile
+        (None if it has the former format) ; an empty Inventory if there's no such file"""
+        path = pathlib.Path(path)
+        if not path.exists() :
+                return Inventory(), None
+        with open(path, "rb") as file :
+                return read_from_file(file)
+
+def load_amounts(path):
+        """Returns the amount of each card stored in the file at path, by (set, number),
+        without decoding the data of the cards (unless the file has the former format)"""
+        path = pathlib.Path(path)
+        if not path.exists() :
+                return dict()
+        with open(path, "rb") as file :
+                if is_collection(file.read(len(HEADER))) :
+                        collection, dummy_cards = CollectionFile.load(file)
+                        return {key:amount for key, amount in collection.amounts.items() if amount > 0}
+                file.seek(0)
+                cards, collection = read_from_file(file)
+        return {Inventory.key(card):card.amount for card in cards}
+
+def load_records(path):
+        """Yields the records of the collection file at path (see collection.read_records),
+        those of a file of the former format being made from its cards"""
+        with open(path, "rb") as file :
+                if is_collection(file.read(len(HEADER))) :
+                        yield from read_records(file)
+                        return
+                file.seek(0)
+                cards, collection = read_from_file(file)
+        for card in cards :
+                yield METADATA, Inventory.key(card), card.metadata()
+                if hasattr(card, "twin") :
+                        yield TWIN, Inventory.key(card), card.twin.metadata()
+                yield AMOUNT, Inventory.key(card), card.amount
+
+def merge_files(path, add, subtract=()):
+        """Writes to the collection file at path (replacing it if it exists) the cards
+        of the files at the paths add, minus those of the files at the paths subtract,
+        the files being read one at a time. Returns the amounts written, by (set, number)"""
+        amounts, metadata, twins = merge((load_records(p), sign) for paths, sign in ((add, 1), (subtract, -1)) for p in paths)
+        replace(path, lambda file:write_contents(file, amounts, metadata, twins))
+        return amounts
+
+def save_collection(path, cards, collection=None):
+        """Saves the Inventory cards to the file at path : appends the changes
+        to collection if there's one, otherwise writes a new collection file.
+        Returns the CollectionFile"""
+        if collection is None :
+                return CollectionFile.create(path, cards, Card.metadata)
+        collection.save(cards, Card.metadata)
+        return collection
+
+
+class lazy :
+        """Class attribute computed by the decorated function when first accessed"""
+
+        lock = threading.RLock() # the import_ids workers may need the mirror at the same time
+
+        def __init__(self, f):
+                self.f = f
+
+        def __get__(self, obj, cls):
+                with lazy.lock :
+                        value = cls.__dict__[self.f.__name__]
+                        if value is self :
+                                value = self.f()
+                                setattr(cls, self.f.__name__, value)
+                        return value
+
+
+class Query :
+        """Query on the cards, answered from the local mirror whenever it can ;
+        what it has to ask the remote API is stored there"""
+
+        def __init__(self, type, mirror):
+                self.params = dict()
+                self.type = type
+                self.mirror = mirror
+
+        def where(self, **kwargs):
+                self.params.update(kwargs)
+                return self
+
+        def find(self, id):
+                response = self.mirror.card(id)
+                if response is None :
+                        import mtgsdk
+                        url = "{}/{}/{}".format(mtgsdk.config.__endpoint__, self.type.RESOURCE, id)
+                        response = Card.http.get(url, ttl=TTL[self.type.RESOURCE])[self.type.RESOURCE[:-1]]
+                        self.mirror.store_cards([response])
+                return self.type(response)
+
+        def iter(self):
+                with instrument.span("mirror.query") :
+                        responses = self.mirror.query(self.params)
+                instrument.count("mirror.misses" if responses is None else "mirror.hits")
+                if responses is None :
+                        responses = list(fetch_raw(self.type.RESOURCE, self.params))
+                        # when the query was for a whole set, the set is now mirrored entirely
+                        whole_set = set(self.params) == {"set"} and "|" not in self.params["set"]
+                        self.mirror.store_cards(responses, synced_set=self.params["set"] if whole_set else None)
+                for response in responses :
+                        yield self.type(response)
+
+        def all(self):
+                return list(self.iter())
+
+
+class Card :
+        """A card, as sent by the API (see mtgsdk.Card), with the amount we own.
+        The fields used all the time (see HOT) are kept decoded, their repeated
+        strings interned ; the whole data is kept compressed, as metadata
+        (see collection.encode), and decoded when one of the others is asked for."""
+
+        RESOURCE = CARDS
+
+        __slots__ = HOT + ("_names", "_metadata", "amount", "twin")
+
+        @lazy
+        def cache():
+                from imgcache import open_cache
+                cache = open_cache(HERE)
+                instrument.register("imgcache", cache.stats)
+                return cache
+
+        @lazy
+        def fetcher():
+                from fetcher import Fetcher
+                return Fetcher(Card.cache)
+
+        @lazy
+        def mirror():
+                from mirror import open_mirror
+                return open_mirror(HERE)
+
+        @lazy
+        def http():
+                from httpcache import open_httpcache
+                http = open_httpcache(HERE)
+                instrument.register("httpcache", http.stats)
+                return http
+
+        def __init__(self, response_dict=dict()):
+                raw = {k:v for k,v in response_dict.items() \
+                        if "_" not in k and k not in ("amount", "twin") and v is not None}
+                self._decode(raw, encode(raw))
+                self.amount = response_dict.get("amount", 1)
+
+        @classmethod
+        def from_metadata(cls, metadata):
+                """The card whose metadata is metadata (as stored in the collection files)"""
+                card = cls.__new__(cls)
+                card._decode(decode(metadata), metadata)
+                card.amount = 1
+                return card
+
+        def _decode(self, raw, metadata):
+                for key in HOT :
+                        value = raw.get(key)
+                        if isinstance(value, str) and key != "text" :
+                                value = sys.intern(value)
+                        elif isinstance(value, list) :
+                                value = INTERNED.setdefault(tuple(value), tuple(value))
+                        setattr(self, key, value)
+                self._names = {sys.intern(f["language"]):f["name"] for f in raw.get("foreignNames") or ()} or NO_NAMES
+                self._metadata = metadata
+
+        @staticmethod
+        def find(id):
+                return Query(Card, Card.mirror).find(id)
+
+        @staticmethod
+        def where(**kwargs):
+                return Query(Card, Card.mirror).where(**kwargs)
+
+        @staticmethod
+        def all():
+                return Query(Card, Card.mirror).all()
+
+        def __eq__(self, other):
+                if not isinstance(other, Card) or self.amount != other.amount :
+                        return False
+                return self._metadata == other._metadata or self.raw() == other.raw()
+
+        __hash__ = None
+
+        def __iadd__(self, amount):
+                """Shortcut for self.amount += xxx"""
+                self.amount += amount
+                return self
+
+        def __isub__(self, amount):
+                """See __iadd__"""
+                self.amount -= amount
+                return self
+
+        def raw(self):
+                """Returns the data of the card as sent by the API, without the amount
+                and twin (the keys are in camelCase, as the API sends them)"""
+                return decode(self._metadata)
+
+        def metadata(self):
+                """Returns the data of the card as sent by the API, encoded (see collection.encode)"""
+                return self._metadata
+
+        def __getstate__(self):
+                return dict(self.raw(), amount=self.amount)
+
+        def __setstate__(self, state):
+                """Also loads the cards pickled by the former versions, which held
+                the data of the API twice (in camelCase, and in snake_case)"""
+                raw = {k:v for k,v in state.items() if "_" not in k and k not in ("amount", "twin") and v is not None}
+                for attr, key in SNAKE_CASE.items() :
+                        if key not in raw and state.get(attr) is not None :
+                                raw[key] = state[attr]
+                self._decode(raw, encode(raw))
+                self.amount = state.get("amount", 1)
+                if state.get("twin") is not None :
+                        self.twin = state["twin"]
+
+        def __getattr__(self, attr) :
+                """foreign_name : see localized_name ; identifier : the text the
+                filter searches ; rarity_level : the index of the rarity in RARITY.
+                The fields of the API that aren't kept decoded are decoded here
+                (with the names mtgsdk.Card gives them), None when missing"""
+                if attr in SAME_CASE :
+                        return self.raw().get(attr)
+                elif attr in SNAKE_CASE :
+                        return self.raw().get(SNAKE_CASE[attr])
+                elif attr not in (
+                        "foreign_name",
+                        "identifier",
+                        "rarity_level"
+                        ) :
+                        raise AttributeError("No such atribute : "+attr)
+                elif attr == "identifier" :
+                        return " ".join(str(getattr(self, x, str())).lower() for x in (
+                                        "foreign_name",
+                                        "subtype",
+                                        "type",
+                                        "supertype",
+                                        "watermark",
+                                        "text"))
+                elif attr == "rarity_level" :
+                        return RARITY.index(self.rarity)
+                else : # foreign_name
+                        return self.localized_name()
+
+        def localized_name(self, language=None):
+                """Returns, if present, the name of the card in language (LANG by default),
+                else card.name (in English) ; both halves for a flip card"""
+                if self.number.endswith("a"):
+                        if not hasattr(self, "twin") :
+                                number = self.number[:-1]+"b"
+                                self.twin  = Card.where(set=self.set, number=number).all()[0]
+                        return self._get_foreign_name(language) + " // " + self.twin._get_foreign_name(language)
+                elif self.number.endswith("b") :
+                        if not hasattr(self, "twin") :
+                                number = self.number[:-1]+"a"
+                                self.twin = Card.where(set=self.set, number=number).all()[0]
+                        return self.twin._get_foreign_name(language) + " // " + self._get_foreign_name(language)
+                else :
+                        return self._get_foreign_name(language)
+
+        def _get_foreign_name(card, language=None):
+                return card._names.get(language or LANG, card.name)
+
+        def picture(card, language=None):
+                """Returns the key of the picture of the card in the images cache, and its URL
+                (None if there's none) : the picture in language (LANG by default)
+                if there's one, otherwise the English one"""
+                raw = card.raw()
+                if raw.get("imageUrl") is None :
+                        return "back.jpeg", None
+                language = language or LANG
+                for l in raw.get("foreignNames") or () :
+                        if l["language"] == language :
+                                if l.get("imageUrl") is not None :
+                                        return picture_key(card.multiverseid, language), l["imageUrl"]
+                                break
+                return picture_key(card.multiverseid, "English"), raw["imageUrl"]
+
+        def getimg(card, variant=None):
+                """Retrives and returns the picture of the card
+                if possible, in the global LANG language, as a PhotoImage
+                of its variant (see imgcache ; DETAIL by default).
+                This blocks until it's downloaded : see fetchimg"""
+                from PIL import ImageTk
+                from imgcache import DETAIL
+                variant = variant or DETAIL
+                key, url = card.picture()
+                try :
+                        return ImageTk.PhotoImage(Card.cache.variant(key, variant))
+                except KeyError :
+                        pass
+                import urllib.request
+                with instrument.span("net.image", url) :
+                        data = urllib.request.urlopen(url).read()
+                Card.cache.put(key, data)
+                return ImageTk.PhotoImage(Card.cache.variant(key, variant))
+
+        def fetchimg(card, callback=None, priority=None):
+                """Same as getimg, but downloads (and scales) in the background,
+                with priority (see fetcher ; URGENT by default).
+                Returns the DETAIL variant of the picture as a PIL Image if it's
+                cached already ; otherwise returns None, and callback will be
+                called later on from the Tk main loop with the PIL Image
+                (None if the download failed)"""
+                key, url = card.picture()
+                if url is None or Card.cache.ready(key) :
+                        return Card.cache.variant(key)
+                if priority is None :
+                        from fetcher import URGENT as priority
+                Card.fetcher.fetch(key, url, callback, priority)
@@ -0,0 +1,113 @@
+"""Downloads the pictures of the cards in the background"""
+
+import http.client, urllib.parse, threading, queue, itertools
+
+import instrument
+
+
+URGENT = 0 # the picture is to be displayed right now
+PREFETCH = 1 # the picture will probably be displayed soon
+
+MAX_REDIRECTS = 5
+
+
+class Fetcher :
+        """Pool of worker threads downloading pictures into an ImgCache.
+        Each worker keeps one keep-alive HTTP connection per host.
+        The callbacks are never called from the workers : they are queued,
+        and called by deliver, which is meant to be polled from the Tk main
+        loop (Tk isn't thread-safe)."""
+
+        def __init__(self, cache, workers=4):
+                self.cache = cache
+                self.queue = queue.PriorityQueue()
+                self.done = queue.Queue()
+                self.lock = threading.Lock()
+                self.pending = dict() # key -> callbacks, for the keys queued or downloading
+                self.inflight = set() # keys being downloaded
+                self.order = itertools.count() # FIFO among the requests of the same priority
+                for i in range(workers) :
+                        threading.Thread(target=self._work, name="fetcher-{}".format(i), daemon=True).start()
+
+        def fetch(self, key, url, callback=None, priority=URGENT):
+                """Downloads url into the cache under key, then calls callback
+                with the DETAIL variant of the picture (or None if the download failed).
+                If the picture is stored already, only its variants are made.
+                Requesting a key already queued only raises its priority."""
+                key = str(key)
+                with self.lock :
+                        if key in self.pending :
+                                if callback is not None :
+                                        self.pending[key].append(callback)
+                                if key in self.inflight or priority == PREFETCH :
+                                        return
+                        else :
+                                self.pending[key] = [] if callback is None else [callback]
+                # a request of higher priority may be queued twice : the worker skips the stale one
+                self.queue.put((priority, next(self.order), key, url))
+
+        def deliver(self):
+                """Calls the callbacks of the finished downloads, in the calling thread"""
+                while True :
+                        try :
+                                callbacks, img = self.done.get_nowait()
+                        except queue.Empty :
+                                return
+                        for callback in callbacks :
+                                callback(img)
+
+        def _work(self):
+                connections = dict() # (scheme, netloc) -> connection, kept alive
+                while True :
+                        priority, _, key, url = self.queue.get()
+                        with self.lock :
+                                if key not in self.pending or key in self.inflight :
+                                        continue
+                                self.inflight.add(key)
+                        try :
+                                if key in self.cache :
+                                        img = self.cache.variant(key) # makes the variants if needed
+                                else :
+                                        with instrument.span("net.image", url) :
+                                                data = self._get(connections, url)
+                                        img = self.cache.put(key, data)
+                        except Exception :
+                                instrument.count("fetcher.failures")
+                                img = None
+                        with self.lock :
+                                self.inflight.discard(key)
+                                callbacks = self.pending.pop(key)
+                        self.done.put((callbacks, img))
+
+        @staticmethod
+        def _get(connections, url):
+                """Returns the body at url, reusing (or opening) the connection to its host"""
+                for i in range(MAX_REDIRECTS) :
+                        parts = urllib.parse.urlsplit(url)
+                        path = parts.path or "/"
+                        if parts.query :
+                                path += "?" + parts.query
+                        host = (parts.scheme, parts.netloc)
+                        for retry in (True, False) :
+                                conn = connections.get(host)
+                                if conn is None :
+                                        cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+                                        conn = connections[host] = cls(parts.netloc, timeout=30)
+                                try :
+                                        conn.request("GET", path, headers={"User-Agent":"Mozilla/5.0"})
+                                        resp = conn.getresponse()
+                                        data = resp.read() # must be read entirely before the connection can be reused
+                                        break
+                                except (http.client.HTTPException, ConnectionError) :
+                                        # the server closed the idle connection : open a new one, once
+                                        conn.close()
+                                        del connections[host]
+                                        if not retry :
+                                                raise
+                        if resp.status in (301, 302, 303, 307, 308) :
+                                url = urllib.parse.urljoin(url, resp.getheader("Location"))
+                                continue
+                        if resp.status != 200 :
+                                raise OSError("HTTP error {} for {}".format(resp.status, url))
+                        return data
+                raise OSError("Too many redirects for "+url)
@@ -0,0 +1,117 @@
+"""Index over the identifiers of the cards, for the filter box"""
+
+import bisect
+
+
+SEPARATOR = "\0" # can't be typed in a query, so no match spans two identifiers
+NARROWING_RATIO = 4 # the previous result is narrowed if it's that much smaller than the index
+DENSE_RATIO = 16 # past len(index)/DENSE_RATIO matches, the corpus isn't scanned anymore
+
+
+class FilterIndex :
+        """Finds the cards whose identifier contains a given query.
+        The identifiers are computed once per card and joined in a corpus
+        (rebuilt lazily after changes), searched at C speed with str.find ;
+        the offsets of the matches are mapped back to the cards by bisection.
+        When a query extends the previous one (one more character typed),
+        only the cards matching the previous one are checked.
+        The identifiers computed in the other languages are kept (see switch).
+        The cards are told apart by identity, since they aren't hashable."""
+
+        def __init__(self, key=lambda card:card.identifier, language=None):
+                self.key = key
+                self.language = language # the one of the identifiers
+                self.others = dict() # language -> (texts, cards) of the identifiers computed in it, until it's LANG again
+                self.texts = dict() # id(card) -> identifier
+                self.cards = dict() # id(card) -> card, to keep the ids valid
+                self.corpus = None # the identifiers joined by SEPARATOR, None when outdated
+                self.starts = list() # offset of each identifier in the corpus, then a sentinel
+                self.order = list() # id(card) of each identifier in the corpus
+                self.last = (None, None) # last query, and the ids matching it
+
+        def __len__(self):
+                return len(self.texts)
+
+        def __contains__(self, card):
+                return id(card) in self.texts
+
+        def _changed(self):
+                self.corpus = None
+                self.last = (None, None)
+
+        def add(self, card):
+                if id(card) in self.texts :
+                        return
+                self.texts[id(card)] = self.key(card)
+                self.cards[id(card)] = card
+                self._changed()
+
+        def discard(self, card):
+                if self.texts.pop(id(card), None) is not None :
+                        del self.cards[id(card)]
+                        self._changed()
+                for texts, cards in self.others.values() :
+                        texts.pop(id(card), None)
+                        cards.pop(id(card), None)
+
+        def sync(self, cards):
+                """Makes the index hold cards, and only them ;
+                the identifiers of the cards it held already are kept"""
+                texts, self.cards = self.texts, {id(card):card for card in cards}
+                self.texts = {i:texts[i] if i in texts else self.key(card) for i, card in self.cards.items()}
+                self._changed()
+                for texts, cards in self.others.values() : # they'd keep the cards not held anymore alive
+                        for i in [i for i in cards if i not in self.cards] :
+                                texts.pop(i, None)
+                                del cards[i]
+
+        def switch(self, language):
+                """Makes the identifiers those in language, which LANG has just become :
+                those computed the last time it was are reused, the current ones
+                are kept for when it's switched back"""
+                if language == self.language :
+                        return
+                self.others[self.language] = (self.texts, dict(self.cards))
+                texts, cards = self.others.pop(language, (dict(), dict()))
+                self.language = language
+                self.texts = {i:texts[i] if cards.get(i) is card else self.key(card) for i, card in self.cards.items()}
+                self._changed()
+
+        def matches(self, card, query):
+                """True if the identifier of card, which must be indexed, contains query"""
+                return query in self.texts[id(card)]
+
+        def _build(self):
+                self.order = list(self.texts)
+                self.starts = list()
+                pos = 0
+                for i in self.order :
+                        self.starts.append(pos)
+                        pos += len(self.texts[i]) + len(SEPARATOR)
+                self.starts.append(pos) # sentinel
+                self.corpus = SEPARATOR.join(self.texts[i] for i in self.order)
+
+        def match(self, query):
+                """Returns the set of the id()s of the cards whose identifier contains query"""
+                prev, prevmatched = self.last
+                if prev is not None and prev in query and len(prevmatched)*NARROWING_RATIO < len(self.texts) :
+                        texts = self.texts
+                        matched = {i for i in prevmatched if query in texts[i]}
+                else :
+                        if self.corpus is None :
+                                self._build()
+                        find, starts, order = self.corpus.find, self.starts, self.order
+                        matched = set()
+                        budget = len(order) // DENSE_RATIO
+                        pos = find(query)
+                        while pos >= 0 :
+                                slot = bisect.bisect_right(starts, pos) - 1
+                                matched.add(order[slot])
+                                if len(matched) > budget :
+                                        # too many matches to map them one by one : check the remaining cards directly
+                                        texts = self.texts
+                                        matched.update(i for i in order[slot+1:] if query in texts[i])
+                                        break
+                                pos = find(query, starts[slot+1]) # the next matches are in the next identifiers
+                self.last = (query, matched)
+                return matched
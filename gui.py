@@ -0,0 +1,603 @@
+"""The graphical user interface"""
+
+import collections
+from PIL import ImageTk
+from tkinter.filedialog import askopenfile, asksaveasfilename
+from tkinter.simpledialog import askstring
+from tkinter.messagebox import showerror, askokcancel
+from tkinter import LabelFrame, OptionMenu # tix ones are buggy...
+from tkinter import tix
+
+import instrument
+from fetcher import PREFETCH
+from imgcache import THUMB
+from filterindex import FilterIndex
+from sortkeys import SortKeys
+from inventory import CardList, Inventory
+from cardlist import VirtualList
+from core import Card, list_sets, read_ids, import_ids, read_from_file, parse_id, \
+        find_stored, lookup, save_collection, get_language, set_language, LANGUAGES
+
+
+SORT_PARAMS = [
+        ("nom", "foreign_name"),
+        ("coût", "cmc"),
+        ("type", "types"),
+        ("rareté", "rarity_level")]
+PREFETCH_AROUND = 3 # number of rows above and below the selection whose pictures are prefetched
+FETCH_POLL_DELAY = 50 # ms between two checks for downloaded pictures
+FILTER_DELAY = 150 # ms without keystroke before the filter is applied
+STATS_DELAY = 500 # ms between two refreshes of the stats window
+GROUPS = [ # what the collection window may group the cards by
+        ("rareté", "rarity"),
+        ("coût", "cmc"),
+        ("type", "type"),
+        ("couleur", "color"),
+        ("édition", "set")]
+BAR_WIDTH = 30 # characters of the longest bar of the collection window
+PHOTOS = 64 # PhotoImages kept ready to be shown again
+
+
+def require_mtgsdk():
+        """Offers to install mtgsdk if it's missing (it's needed to look up
+        the cards), and exits if it's refused.
+        Returns the Tk created to ask, None if mtgsdk is there"""
+        import importlib
+        try :
+                importlib.import_module("mtgsdk")
+        except ModuleNotFoundError :
+                main = tix.Tk()
+                if askokcancel("Dépendance introuvable","mtgsdk (nécessaire au bon focntionnement) n'est pas installé... Installer ?") :
+                        import os
+                        os.popen("pip3 install mtgsdk").read()
+                        importlib.invalidate_caches() # so that the new package is found
+                        importlib.import_module("mtgsdk") # raises if it couldn't be installed
+                else :
+                        exit(1)
+                return main
+        else :
+                return None
+
+
+class CardPresenter :
+
+        def __init__(self, master=None, cards=list()):
+                if master is None :
+                        self.main = tix.Tk()
+                else :
+                        self.main = master
+                self.photos = Photos()
+                self.main.resizable(False, True)
+
+                # left part : list of all the cards
+                self._cards = Inventory() # for mention only ; self.update fills it
+                # self._cards represents all the stored cards
+                # self.cards is self._cards after user-filtering
+                # see update and below
+                self._view = CardList() # self.cards, computed by update
+                self.index = FilterIndex(language=get_language()) # over self._cards
+                self.sortkeys = SortKeys([attr for name, attr in SORT_PARAMS], get_language()) # of self._cards
+                self.columns = None # columns.Columns of self._cards, made when the collection window is first opened
+                self.pending_update = None # see schedule_update
+                self.collection = None # the CollectionFile saved to, see save
+                self.names = VirtualList(self.main, self.label, width=30, bg="#ffffff")
+
+                # right part : single-card details and picture
+                # top : picture
+                self.imglbl = tix.Label(self.main)
+                self.flipped = False
+
+                # bottom : filters
+                self.rightpart = tix.Frame(self.main)
+
+                self.sort = LabelFrame(self.rightpart, text="Trier par : ")
+                self.sortby = tix.StringVar(self.sort, "foreign_name")
+                self.sort_buttons = list()
+                for i, (d,s) in enumerate(SORT_PARAMS) :
+                        b = tix.Radiobutton(self.sort, text=d, value=s, variable=self.sortby)
+                        b.grid(row=i, column=0, sticky="w")
+                        self.sort_buttons.append(b)
+
+                self.filter = LabelFrame(self.rightpart, text="Filtrer :")
+                self.filter_query = tix.StringVar(self.filter)
+                self.f_e = tix.Entry(self.filter, textvariable=self.filter_query, width=30)
+                self.language = tix.StringVar(self.filter, get_language())
+                self.languages = OptionMenu(self.filter, self.language, *LANGUAGES)
+
+                # buttons to add a card
+                self.addacard = tix.Button(self.rightpart, text=" + ", command=self.search)
+                self.askcode =  tix.Button(self.rightpart, text=" ? ", command=self.showsets)
+                self.importids = tix.Button(self.rightpart, text="Importer", command=self.import_file)
+                self.showsummary = tix.Button(self.rightpart, text="Bilan", command=self.toggle_summary)
+                self.set_codes = None
+                self.stats = None # the StatsWindow, when it's open
+                self.summary = None # the CollectionWindow, idem
+
+                self.main.bind_all("<Control-s>", self.save)
+                self.main.bind_all("<Control-S>", self.save_as) # with shift
+                self.main.bind_all("<Control-o>", self.load)
+                self.main.bind_all("<Control-i>", self.import_file)
+                self.names.bind_all("<<ListboxSelect>>", self.display_card)
+                self.main.bind_all("<KP_Add>", self.inc) # "+" from the numeric pad
+                self.main.bind_all("<plus>", self.inc) # "+" from the alphabetic pad
+                self.main.bind_all("<KP_Subtract>", self.dec) # idem
+                self.main.bind_all("<minus>", self.dec)
+                self.main.bind_all("<F12>", self.toggle_stats)
+                self.sortby.trace("w", lambda x,y,z:self.update(self._cards))
+                self.filter_query.trace("w", lambda x,y,z:self.schedule_update())
+                self.language.trace("w", lambda x,y,z:self.switch_language(self.language.get()))
+                self.imglbl.bind("<Button-1>",self.switch_img)
+
+
+                self.names.pack(side="left", fill="y")
+                self.imglbl.pack(side="top", fill="x")
+                self.rightpart.pack(side="top", fill="both", expand=True)
+                self.sort.grid(row=0, column=0, sticky="nsew")
+                self.f_e.pack()
+                self.languages.pack()
+                self.filter.grid(row=0, column=1, columnspan=3, sticky="nsew")
+                self.addacard.grid(row=1, column=3)
+                self.askcode.grid(row=1, column=2)
+                self.importids.grid(row=1, column=1, sticky="e")
+                self.showsummary.grid(row=1, column=0, sticky="w")
+                # these were useful when there was no filter above to fill the place...
+                self.rightpart.grid_rowconfigure(0, weight=1)
+                self.rightpart.grid_columnconfigure(1, weight=1)
+
+                self.update(cards)
+                self.deliver_imgs()
+
+        def save(self, dummy_arg=None):
+                """Saves to the file last saved to or loaded, appending only
+                the changes since ; asks the file first if there's none"""
+                if self.collection is None :
+                        return self.save_as()
+                self.collection.save(self._cards, Card.metadata)
+                # we must access _cards directly to get the cards that are hidden by the filter
+
+        def save_as(self, dummy_arg=None):
+                # We should also find a way to store the pictures
+                path = asksaveasfilename()
+                if not path :
+                        return
+                self.collection = save_collection(path, self._cards)
+
+        def load(self, dummy_arg=None, *, file=None):
+                if file is None :
+                        file = askopenfile(mode="rb")
+                if file is None :
+                        return
+                with file :
+                        cards, self.collection = read_from_file(file)
+                self.update(cards)
+
+        def import_file(self, dummy_arg=None):
+                file = askopenfile(mode="r", filetypes=[("Liste de cartes", "*.txt *.csv"), ("Tous les fichiers", "*")])
+                if file is None :
+                        return
+                with file :
+                        ids, errors = read_ids(file)
+                if errors :
+                        showerror("Saisie incorrecte", "Lignes mal formées : "+", ".join(map(str, errors[:20]))+"…"*(len(errors)>20))
+                        return
+                found, missing = import_ids(ids)
+                for card, amount in found :
+                        stored = self._cards.add(card, amount)
+                        self.track("add" if stored is card else "refresh", stored)
+                self.update(self._cards) # sorts once for all the cards
+                if missing :
+                        showerror("Aucune carte trouvée", "Cartes introuvables : "+", ".join(missing[:20])+"…"*(len(missing)>20))
+
+        def update(self, cards=None):
+                """updates the text displayed in self.names, using the filter query.
+                If cards is given, that Inventory (or list) will be used as self._cards
+                (and will replace it) after being sorted.
+                No cards, no sorting !"""
+                if self.pending_update is not None :
+                        self.main.after_cancel(self.pending_update)
+                        self.pending_update = None
+                if cards is not None :
+                        with instrument.span("ui.sort") :
+                                replaced = cards is not self._cards # not a mere sort : the columns follow the changes otherwise
+                                self._cards = cards if isinstance(cards, Inventory) else Inventory(cards)
+                                self.sortkeys.sync(self._cards)
+                                self._cards.sort(key=self.sortkeys.key(self.sort_attrs()))
+                                self.index.sync(self._cards)
+                                if self.columns is not None and replaced :
+                                        self.columns.sync(self._cards)
+                with instrument.span("ui.filter") :
+                        self._view = self._get_filtered()
+                self.names.set_items(self._view) # keeps the selected card selected if it's still shown
+                if not self.names.curselection() :
+                        self.selection_reset()
+
+        def switch_language(self, language):
+                """Shows the names and pictures of the cards in language ; the names
+                and pictures already got in the former one are kept for later"""
+                set_language(language)
+                self.sortkeys.switch(language, self._cards)
+                self.index.switch(language)
+                self.update(self._cards)
+                if self.names.curselection() :
+                        self.display_card()
+
+        def sort_attrs(self):
+                """The attributes the cards are sorted by : the one chosen, then the name"""
+                return [self.sortby.get(), "foreign_name"]
+
+        @staticmethod
+        def label(card):
+                return card.foreign_name+" (x{})".format(card.amount)*bool(card.amount-1)
+
+        def insert_card(self, card):
+                """Adds card to self._cards where it belongs, and to the list if it passes
+                the filter, without sorting everything again.
+                Returns its index in self.cards, or None if it's filtered out"""
+                self.sortkeys.add(card)
+                self.index.add(card)
+                self.track("add", card)
+                attrs = self.sort_attrs()
+                self._cards.add(card, index=self.sortkeys.insertion_point(self._cards, card, attrs))
+                fq = self.filter_query.get().strip()
+                if fq and not self.index.matches(card, fq) :
+                        return None
+                index = self.sortkeys.insertion_point(self._view, card, attrs)
+                self._view.insert(index, card)
+                self.names.insert(index, card)
+                return index
+
+        def schedule_update(self):
+                """Updates the list FILTER_DELAY ms after the last keystroke only"""
+                if self.pending_update is not None :
+                        self.main.after_cancel(self.pending_update)
+                self.pending_update = self.main.after(FILTER_DELAY, self.update)
+
+        def _get_filtered(self):
+                fq = self.filter_query.get().strip()
+                if not fq :
+                        return CardList(self._cards)
+                matched = self.index.match(fq)
+                return CardList(card for card in self._cards if id(card) in matched)
+
+        def _get(self):
+                return self._view
+
+        cards = property(_get, update)
+
+        def update_one(self, index):
+                self.names.refresh(index)
+
+        def track(self, change, card):
+                """Applies change ("add", "discard" or "refresh", after the amount
+                of card changed) to the columns, if they're made"""
+                if self.columns is not None :
+                        getattr(self.columns, change)(card)
+
+        def get_columns(self):
+                if self.columns is None :
+                        from columns import Columns
+                        self.columns = Columns(self._cards)
+                return self.columns
+
+        def selection_reset(self):
+                self.curimg = self.photos.back()
+                self.imglbl.configure(image=self.curimg)
+                self.curindex = None
+                self.shown = None
+
+        def display_card(self, dummy_arg=None):
+                index = self.names.curselection()
+                if not index : return # if no selection
+                index = index[0]
+                cards = self.cards
+                card = cards[index]
+                self.show_img(card)
+                self.curindex = index
+                self.flipped = False
+                for neighbour in cards[max(0, index-PREFETCH_AROUND):index+PREFETCH_AROUND+1] :
+                        neighbour.fetchimg(priority=PREFETCH)
+
+        def switch_img(self, dummy_arg=None):
+                index = self.names.curselection()
+                if not index : return # if no selection
+                index = index[0]
+                card = self.cards[index]
+                if self.flipped :
+                        self.display_card()
+                elif hasattr(card,"twin") :
+                        self.show_img(card.twin)
+                        self.flipped = True
+
+        @instrument.timed("ui.image")
+        def show_img(self, card):
+                """Displays the picture of card ; the placeholder is shown
+                until it's downloaded, if it's not cached yet"""
+                self.shown = card
+                key = card.picture()[0]
+                photo = self.photos.get(key)
+                if photo is None :
+                        def ready(img):
+                                if img is not None :
+                                        photo = self.photos.put(key, img)
+                                        if self.shown is card :
+                                                self.curimg = photo
+                                                self.imglbl.configure(image=self.curimg)
+                        img = Card.fetchimg(card, ready)
+                        photo = self.photos.back() if img is None else self.photos.put(key, img)
+                self.curimg = photo
+                self.imglbl.configure(image=self.curimg)
+
+        def deliver_imgs(self):
+                """Displays the pictures downloaded in the meantime, periodically"""
+                Card.fetcher.deliver()
+                self.main.after(FETCH_POLL_DELAY, self.deliver_imgs)
+
+
+        def search(self,initial=str()):
+                # 1. Ask the card ID (set + number)
+                resp = askstring("Ajouter une carte", "Saisissez l'identifiant à 6~8 caractères en bas à gauche de la carte", initialvalue=initial)
+                if resp is None :
+                        return
+                id = parse_id(resp)
+                if id is None :
+                        showerror("Saisie incorrecte", "Assurez-vous d'avoir correctement saisi l'identifiant (en respectant la casse)")
+                        return
+                set_id, num = id
+
+                # if the card's already stored, we can add it manually without request to the remote API
+                card = find_stored(self._cards, set_id, num)
+                if card is not None :
+                        card += 1
+                        self.track("refresh", card)
+                        if card in self.cards : #means it's displayed
+                                # it may be not the same index in self.cards and self._cards
+                                index = self.cards.index(card)
+                                self.update_one(index)
+                                self.names.selection_set(index)
+                                self.display_card()
+                        return
+
+                # 2. Proceed the request
+                rq = lookup(set_id, num)
+                if not len(rq) :
+                        showerror("Aucune carte trouvée", "Le service distant ne répond pas, ou vérifiez votre saisie")
+                        return
+                if len(rq) > 1 : # never happens yet
+                        tl = tix.Toplevel(self.main)
+                        lf = tix.LabelFrame(tl, text="Carte(s) trouvée(s), cliquez sur la bonne")
+                        lf.pack(fill="both",expand=True)
+                        tl.images = [card.getimg(THUMB) for card in rq] # Tk doesn't keep a reference on them
+                        for i,card in enumerate(rq):
+                                def mkbuttonjob(tl, rq, card):
+                                        def buttonjob():
+                                                tl.destroy()
+                                                rq.clear()
+                                                rq.append(card)
+                                        return buttonjob
+                                tix.Button(lf, image=tl.images[i], command=mkbuttonjob(tl, rq, card)).grid(row=0, column=i)
+                        tl.wait_window() # until one is clicked (or the window is closed : the first one is taken)
+
+                rq = rq[0]
+                # 3. Add the found card to the existing database
+                rq.fetchimg(priority=PREFETCH)
+                self.selection_reset()
+                self.names.selection_clear()
+                index = self.insert_card(rq)
+                if index is not None : # it passes the filter
+                        self.names.selection_set(index)
+                        self.display_card()
+
+        def _select_update(f):
+                def f_(self, dummy_arg=None):
+                        index = self.names.curselection()
+                        if not index : return
+                        index = index[0]
+                        card = self.cards[index]
+
+                        if f(self, card) is None : # if f returns something if we don't have to update the selection
+                                self.update_one(index)
+
+                                self.names.selection_set(index)
+                return f_
+
+        @_select_update
+        def inc(self, card):
+                """Increases the selected card's amount by 1"""
+                card += 1
+                self.track("refresh", card)
+
+        @_select_update
+        def dec(self, card):
+                """Decreases the selected card's amount by 1,
+                and removes it (after confirm) if it reaches 0"""
+                if card.amount == 1 :
+                        if askokcancel("Confirmation de suppression","Supprimer cette carte de l'inventaire ?") :
+                                index = self.cards.index(card)
+                                self._cards.remove(card)
+                                del self._view[index]
+                                self.index.discard(card)
+                                self.sortkeys.discard(card)
+                                self.track("discard", card)
+                                self.names.delete(index)
+                                self.selection_reset()
+                        return -1
+                else :
+                        card -= 1
+                        self.track("refresh", card)
+
+        def toggle_stats(self, dummy_arg=None):
+                """Opens the stats window (which starts the measures), or closes it"""
+                if self.stats is None :
+                        self.stats = StatsWindow(self.main, self.forget_stats)
+                else :
+                        self.stats.destroy()
+
+        def forget_stats(self):
+                self.stats = None
+
+        def toggle_summary(self, dummy_arg=None):
+                """Opens the collection window, or closes it"""
+                if self.summary is None :
+                        self.summary = CollectionWindow(self.main, self.get_columns, self.forget_summary)
+                else :
+                        self.summary.destroy()
+
+        def forget_summary(self):
+                self.summary = None
+
+        def showsets(self):
+                if self.set_codes is None :
+                        self.set_codes = list_sets()
+                tl = tix.Toplevel(self.main.master)
+                lb = tix.ScrolledListBox(tl)
+                lb.listbox.insert(0, *[x[0] for x in self.set_codes])
+                lb.listbox.configure(width=30, height=30, bg="#ffffff")
+                tl.bind("<Escape>", tl.destroy)
+                def finish(event):
+                        index = lb.listbox.curselection()
+                        if not len(index) :
+                                return
+                        self.search(self.set_codes[index[0]][1])
+                        tl.destroy()
+                lb.listbox.bind("<<ListboxSelect>>", finish)
+                lb.pack(fill="both",expand=True)
+
+
+class Photos :
+        """The PhotoImages of the pictures shown last (PHOTOS of them, least
+        recently used first), so that showing them again is instant ;
+        and that of back.jpeg, made once"""
+
+        def __init__(self, size=PHOTOS):
+                self.size = size
+                self.photos = collections.OrderedDict() # key -> PhotoImage
+                self._back = None
+
+        def back(self):
+                if self._back is None :
+                        self._back = ImageTk.PhotoImage(Card.cache.variant("back.jpeg"))
+                return self._back
+
+        def get(self, key):
+                photo = self.photos.get(key)
+                if photo is not None :
+                        self.photos.move_to_end(key)
+                return photo
+
+        def put(self, key, img):
+                """Makes the PhotoImage of img, a PIL Image, and keeps it under key"""
+                photo = self.photos[key] = ImageTk.PhotoImage(img)
+                self.photos.move_to_end(key)
+                while len(self.photos) > self.size :
+                        self.photos.popitem(last=False)
+                return photo
+
+class StatsWindow(tix.Toplevel) :
+        """Shows the measures of instrument, refreshed every STATS_DELAY ms.
+        Opening it starts the measures ; they go on once it's closed,
+        unless they were stopped with the check button."""
+
+        def __init__(self, master, on_destroy):
+                super().__init__(master)
+                self.title("Statistiques")
+                self.on_destroy = on_destroy
+                instrument.enable()
+                self.measuring = tix.BooleanVar(self, True)
+                buttons = tix.Frame(self)
+                tix.Checkbutton(buttons, text="Mesurer", variable=self.measuring, command=self.switch).pack(side="left")
+                tix.Button(buttons, text="Remettre à zéro", command=instrument.reset).pack(side="left")
+                tix.Button(buttons, text="Exporter…", command=self.export).pack(side="left")
+                buttons.pack(side="top", fill="x")
+                self.text = tix.Text(self, width=78, height=30, font="TkFixedFont", bg="#ffffff")
+                self.text.pack(side="top", fill="both", expand=True)
+                self.bind("<Escape>", lambda event:self.destroy())
+                self.protocol("WM_DELETE_WINDOW", self.destroy)
+                self.pending = None
+                self.refresh()
+
+        def destroy(self):
+                if self.pending is not None :
+                        self.after_cancel(self.pending)
+                        self.pending = None
+                super().destroy()
+                self.on_destroy()
+
+        def switch(self):
+                if self.measuring.get() :
+                        instrument.enable()
+                else :
+                        instrument.disable()
+
+        def export(self):
+                path = asksaveasfilename(parent=self, defaultextension=".json",
+                        filetypes=[("Trace JSON", "*.json"), ("Trace CSV", "*.csv")])
+                if path :
+                        instrument.dump(path)
+
+        def refresh(self):
+                stats = instrument.snapshot()
+                lines = ["{:20} {:>7} {:>10} {:>9} {:>9} {:>9}".format("", "n", "total ms", "moy. ms", "max ms", "dern. ms")]
+                for name, s in sorted(stats["spans"].items()) :
+                        lines.append("{:20} {:>7} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f}".format(name, s["count"],
+                                s["total"]*1000, s["mean"]*1000, s["max"]*1000, s["last"]*1000))
+                lines.append("")
+                for name, value in sorted(stats["counters"].items()) :
+                        lines.append("{:30} {:>12}".format(name, value))
+                self.text.delete("1.0", "end")
+                self.text.insert("1.0", "\n".join(lines))
+                self.pending = self.after(STATS_DELAY, self.refresh)
+
+
+class CollectionWindow(tix.Toplevel) :
+        """Shows the cards of the collection grouped by one of GROUPS
+        (see columns), refreshed every STATS_DELAY ms"""
+
+        def __init__(self, master, get_columns, on_destroy):
+                super().__init__(master)
+                self.title("Collection")
+                self.get_columns = get_columns
+                self.on_destroy = on_destroy
+                self.sizes = Card.mirror.set_sizes() # of the synced sets only
+                self.by = tix.StringVar(self, GROUPS[0][1])
+                buttons = tix.Frame(self)
+                for name, by in GROUPS :
+                        tix.Radiobutton(buttons, text=name, value=by, variable=self.by, command=self.refresh).pack(side="left")
+                buttons.pack(side="top", fill="x")
+                self.text = tix.Text(self, width=78, height=30, font="TkFixedFont", bg="#ffffff")
+                self.text.pack(side="top", fill="both", expand=True)
+                self.bind("<Escape>", lambda event:self.destroy())
+                self.protocol("WM_DELETE_WINDOW", self.destroy)
+                self.pending = None
+                self.refresh()
+
+        def destroy(self):
+                if self.pending is not None :
+                        self.after_cancel(self.pending)
+                        self.pending = None
+                super().destroy()
+                self.on_destroy()
+
+        def refresh(self):
+                from columns import CURVE_MAX
+                if self.pending is not None :
+                        self.after_cancel(self.pending)
+                columns = self.get_columns()
+                by = self.by.get()
+                cards, copies = columns.total()
+                lines = ["cartes : {} (différentes : {})".format(copies, cards), "",
+                        "{:16} {:>7} {:>7}".format("", "diff.", "cartes")]
+                groups = columns.group(by)
+                if by == "set" :
+                        groups.sort(key=lambda g:(-g[2], g[0]))
+                most = max([copies for value, cards, copies in groups] or [1])
+                for value, cards, copies in groups :
+                        if by == "cmc" and value == CURVE_MAX :
+                                value = "{}+".format(value)
+                        line = "{:16} {:>7} {:>7} {}".format(str(value if value is not None else "?"), cards, copies,
+                                "█"*max(1, copies*BAR_WIDTH//most))
+                        if by == "set" and value in self.sizes :
+                                line += " {}/{} ({:.0%})".format(cards, self.sizes[value], cards/self.sizes[value])
+                        lines.append(line)
+                self.text.delete("1.0", "end")
+                self.text.insert("1.0", "\n".join(lines))
+                self.pending = self.after(STATS_DELAY, self.refresh)
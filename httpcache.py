@@ -0,0 +1,149 @@
+"""On-disk cache of the JSON responses of the remote API, in SQLite.
+A response is fresh for the time to live given when it's fetched ; once
+stale, it's revalidated (with the ETag and Last-Modified the server sent,
+if any) the next time it's asked for. When the network fails, or in
+offline mode, the stale responses are used rather than nothing.
+The least recently used responses are evicted once the cache grows too large."""
+
+import json, time, zlib, sqlite3, pathlib, threading, urllib.parse
+
+import instrument
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY, -- normalized URL of the query
+        body BLOB NOT NULL, -- zlib-compressed
+        etag TEXT,
+        modified TEXT, -- Last-Modified header
+        expires REAL NOT NULL,
+        used REAL NOT NULL,
+        size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+"""
+TTL = 24*3600 # s a response is fresh for, by default
+MAX_SIZE = 64*2**20 # bytes of compressed bodies kept
+TIMEOUT = 30 # s
+
+
+class Offline(ConnectionError) :
+        """Raised for a query that isn't cached, in offline mode"""
+
+
+def normalize(url, params=dict()):
+        """The key of the query params on url : the same whatever the order
+        of the parameters, the case of the host, and the types of the values"""
+        parts = urllib.parse.urlsplit(url)
+        query = urllib.parse.parse_qsl(parts.query) + [(k, str(v)) for k, v in params.items()]
+        return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+                parts.path.rstrip("/"), urllib.parse.urlencode(sorted(query)), ""))
+
+
+class HttpCache :
+        """The cache, in the SQLite database filename.
+        offline : never use the network, only the cache (stale or not).
+        It may be used from several threads at once."""
+
+        def __init__(self, filename, maxsize=MAX_SIZE, offline=False):
+                self.filename = filename
+                self.maxsize = maxsize
+                self.offline = offline
+                self.lock = threading.Lock()
+                self.db = sqlite3.connect(str(filename), check_same_thread=False)
+                # losing the last responses on a power failure is harmless : no fsync on each commit
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute("PRAGMA synchronous=NORMAL")
+                with self.lock, self.db :
+                        self.db.executescript(SCHEMA)
+                        self.size, = self.db.execute("SELECT coalesce(sum(size), 0) FROM responses").fetchone()
+
+        def close(self):
+                with self.lock :
+                        self.db.close()
+
+        def __len__(self):
+                with self.lock :
+                        return self.db.execute("SELECT count(*) FROM responses").fetchone()[0]
+
+        def stats(self):
+                return dict(entries=len(self), size=self.size)
+
+        def get(self, url, params=dict(), ttl=TTL):
+                """Returns the JSON response to the query params on url, from the cache
+                if it's fresh (for ttl s once fetched), otherwise from the network"""
+                key = normalize(url, params)
+                with self.lock :
+                        row = self.db.execute("SELECT body, etag, modified, expires FROM responses WHERE key = ?",
+                                (key,)).fetchone()
+                now = time.time()
+                if row is not None and (row[3] > now or self.offline) :
+                        instrument.count("httpcache.hits" if row[3] > now else "httpcache.stale")
+                        self._touch(key, now)
+                        return json.loads(zlib.decompress(row[0]).decode())
+                if self.offline :
+                        raise Offline("not cached : "+key)
+                import urllib.request, urllib.error
+                headers = {"User-Agent":"Mozilla/5.0"}
+                if row is not None and row[1] :
+                        headers["If-None-Match"] = row[1]
+                if row is not None and row[2] :
+                        headers["If-Modified-Since"] = row[2]
+                try :
+                        with instrument.span("net.api", key) :
+                                with urllib.request.urlopen(urllib.request.Request(key, headers=headers), timeout=TIMEOUT) as response :
+                                        body = response.read()
+                                        etag, modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+                except urllib.error.HTTPError as e :
+                        if e.code == 304 and row is not None :
+                                instrument.count("httpcache.revalidated")
+                                with self.lock, self.db :
+                                        self.db.execute("UPDATE responses SET expires = ?, used = ? WHERE key = ?", (now+ttl, now, key))
+                                return json.loads(zlib.decompress(row[0]).decode())
+                        if e.code < 500 or row is None :
+                                raise
+                        instrument.count("httpcache.stale") # the server fails : better stale than nothing
+                        return json.loads(zlib.decompress(row[0]).decode())
+                except OSError :
+                        if row is None :
+                                raise
+                        instrument.count("httpcache.stale") # no network
+                        return json.loads(zlib.decompress(row[0]).decode())
+                instrument.count("httpcache.misses")
+                data = json.loads(body.decode("utf-8"))
+                self._store(key, zlib.compress(body), etag, modified, now+ttl, now)
+                return data
+
+        def _touch(self, key, now):
+                with self.lock, self.db :
+                        self.db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+
+        def _store(self, key, body, etag, modified, expires, now):
+                with self.lock, self.db :
+                        old = self.db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                        self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (key, body, etag, modified, expires, now, len(body)))
+                        self.size += len(body) - (old[0] if old else 0)
+                        if self.size > self.maxsize :
+                                self._evict()
+
+        def _evict(self):
+                """Forgets the least recently used responses, down to 3/4 of maxsize
+                (so that it's not done again at once). The lock must be held"""
+                evicted = list()
+                for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY used") :
+                        if self.size <= self.maxsize*3//4 :
+                                break
+                        evicted.append((key,))
+                        self.size -= size
+                self.db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+                instrument.count("httpcache.evictions", len(evicted))
+
+
+def open_httpcache(path):
+        """Opens the responses cache of the application living at path
+        (the zipapp, or the directory of the sources)"""
+        path = pathlib.Path(path)
+        if path.is_dir() :
+                return HttpCache(path/"http.db")
+        return HttpCache(path.with_name(path.stem+"-http.db"))
@@ -0,0 +1,369 @@
+"""Two-level cache for the pictures of the cards : one level on disk, one in RAM.
+Along with each picture, the cache stores its variants : copies scaled down
+to the sizes they're displayed at, so that they're decoded quickly
+(a picture fitting the size already is its own variant)."""
+
+import io, os, mmap, struct, zipfile, pathlib, threading, collections
+from PIL import Image
+
+import instrument
+
+
+PACK_MAGIC = b"MTGp"
+RECORD = struct.Struct("<4sHI") # magic, length of the key, length of the data
+INDEX_ENTRY = struct.Struct("<HQI") # length of the key, offset of the data, length of the data
+DETAIL = "detail" # variant shown in the main window
+THUMB = "thumb" # variant shown when several cards are to be chosen from
+VARIANTS = {DETAIL:(223, 310), THUMB:(112, 155)} # boxes the variants fit in
+
+
+class _Region(io.RawIOBase) :
+        """Read-only file-like view over a part of a mmap,
+        so that PIL decodes the pictures where they lie"""
+
+        def __init__(self, map, offset, length):
+                self.view = memoryview(map)[offset:offset+length]
+                self.pos = 0
+
+        def readable(self):
+                return True
+
+        def seekable(self):
+                return True
+
+        def readinto(self, b):
+                n = max(0, min(len(b), len(self.view)-self.pos))
+                b[:n] = self.view[self.pos:self.pos+n]
+                self.pos += n
+                return n
+
+        def seek(self, pos, whence=0):
+                if whence == 1 :
+                        pos += self.pos
+                elif whence == 2 :
+                        pos += len(self.view)
+                self.pos = max(0, pos)
+                return self.pos
+
+        def tell(self):
+                return self.pos
+
+        def close(self):
+                # the mmap can't be closed nor remapped as long as a view on it exists
+                self.view.release()
+                super().close()
+
+
+class PackStore :
+        """Stores the pictures one after the other in an append-only pack file.
+        A side index file maps each key to the (offset, length) of its data ;
+        since the pack is self-describing, the index is repaired from it
+        when a crash left them out of sync.
+        Writing a key again supersedes the former data, which is only
+        reclaimed by compact."""
+
+        def __init__(self, filename):
+                self.filename = pathlib.Path(filename)
+                self.indexname = self.filename.with_suffix(".idx")
+                self.index = dict() # key -> (offset, length)
+                self.map = None
+                self.fh = open(self.filename, "a+b")
+                self.idxfh = open(self.indexname, "a+b")
+                self._scan(self._read_index())
+                self._remap()
+
+        def _read_index(self):
+                """Loads the index file, drops its torn or inconsistent tail,
+                and returns the offset in the pack where the indexed records end"""
+                packsize = os.path.getsize(self.filename)
+                self.idxfh.seek(0)
+                raw = self.idxfh.read()
+                pos = end = 0
+                while pos + INDEX_ENTRY.size <= len(raw) :
+                        keylen, offset, length = INDEX_ENTRY.unpack_from(raw, pos)
+                        if pos + INDEX_ENTRY.size + keylen > len(raw) or offset + length > packsize :
+                                break
+                        key = raw[pos+INDEX_ENTRY.size:pos+INDEX_ENTRY.size+keylen].decode()
+                        self.index[key] = (offset, length)
+                        end = max(end, offset + length)
+                        pos += INDEX_ENTRY.size + keylen
+                if pos != len(raw) :
+                        self.idxfh.truncate(pos)
+                return end
+
+        def _scan(self, pos):
+                """Indexes the records of the pack written after pos but missing
+                from the index, and truncates the pack after the last whole record"""
+                packsize = os.path.getsize(self.filename)
+                self.fh.seek(pos)
+                while True :
+                        header = self.fh.read(RECORD.size)
+                        if len(header) < RECORD.size :
+                                break
+                        magic, keylen, length = RECORD.unpack(header)
+                        key = self.fh.read(keylen)
+                        offset = pos + RECORD.size + keylen
+                        if magic != PACK_MAGIC or len(key) < keylen or offset + length > packsize :
+                                break
+                        self._add(key.decode(), offset, length)
+                        pos = offset + length
+                        self.fh.seek(pos)
+                self.fh.truncate(pos)
+                self.idxfh.flush()
+
+        def _add(self, key, offset, length):
+                kb = key.encode()
+                self.idxfh.write(INDEX_ENTRY.pack(len(kb), offset, length) + kb)
+                self.index[key] = (offset, length)
+
+        def _remap(self):
+                if self.map is not None :
+                        self.map.close()
+                        self.map = None
+                size = os.path.getsize(self.filename)
+                if size : # empty files can't be mapped
+                        self.map = mmap.mmap(self.fh.fileno(), size, access=mmap.ACCESS_READ)
+
+        def __contains__(self, key):
+                return key in self.index
+
+        def __iter__(self):
+                return iter(self.index)
+
+        def __len__(self):
+                return len(self.index)
+
+        def open(self, key):
+                """Returns a file-like object reading the data stored under key
+                straight from the mmap. Please close it once done."""
+                offset, length = self.index[key]
+                if self.map is None or offset + length > len(self.map) :
+                        self._remap()
+                return _Region(self.map, offset, length)
+
+        def write(self, key, data):
+                kb = key.encode()
+                start = self.fh.seek(0, 2)
+                self.fh.write(RECORD.pack(PACK_MAGIC, len(kb), len(data)) + kb)
+                self.fh.write(data)
+                # the data must be on disk before the index points to it
+                self.fh.flush()
+                self._add(key, start + RECORD.size + len(kb), len(data))
+                self.idxfh.flush()
+
+        def compact(self):
+                """Rewrites the pack without the superseded records,
+                and returns the number of bytes reclaimed"""
+                before = os.path.getsize(self.filename)
+                self._remap() # the records written since the last mapping must be readable
+                tmp = self.filename.with_suffix(".pack.tmp")
+                tmpidx = self.filename.with_suffix(".idx.tmp")
+                index = dict()
+                with open(tmp, "wb") as pack, open(tmpidx, "wb") as idx :
+                        for key, (offset, length) in sorted(self.index.items(), key=lambda x:x[1]) :
+                                kb = key.encode()
+                                pack.write(RECORD.pack(PACK_MAGIC, len(kb), length) + kb)
+                                index[key] = (pack.tell(), length)
+                                pack.write(self.map[offset:offset+length])
+                                idx.write(INDEX_ENTRY.pack(len(kb), index[key][0], length) + kb)
+                        pack.flush()
+                        os.fsync(pack.fileno())
+                        idx.flush()
+                        os.fsync(idx.fileno())
+                self.close()
+                os.replace(tmp, self.filename)
+                os.replace(tmpidx, self.indexname)
+                self.fh = open(self.filename, "a+b")
+                self.idxfh = open(self.indexname, "a+b")
+                self.index = index
+                self._remap()
+                return before - os.path.getsize(self.filename)
+
+        def close(self):
+                if self.map is not None :
+                        self.map.close()
+                        self.map = None
+                self.fh.close()
+                self.idxfh.close()
+
+
+def migrate(zipname, store):
+        """Copies to store every picture of the zip file zipname
+        that it doesn't hold yet, and returns how many were copied"""
+        n = 0
+        with zipfile.ZipFile(zipname) as zf :
+                for info in zf.infolist() :
+                        if info.is_dir() or info.filename.endswith((".py", ".pyc")) or info.filename in store :
+                                continue
+                        store.write(info.filename, zf.read(info))
+                        n += 1
+        return n
+
+
+def open_cache(path, maxbytes=32*2**20):
+        """Opens the images cache of the application living at path (the zipapp,
+        or the directory of the sources). The pictures are stored in a pack
+        file next to it ; the first time, those the former versions stored
+        in the zipapp itself are migrated to it."""
+        path = pathlib.Path(path)
+        if path.is_dir() :
+                packname = path/"cache.pack"
+        else :
+                packname = path.with_suffix(".pack")
+        new = not packname.exists()
+        store = PackStore(packname)
+        if new and zipfile.is_zipfile(path) :
+                migrate(path, store)
+        elif "back.jpeg" not in store and (path/"back.jpeg").is_file() :
+                store.write("back.jpeg", (path/"back.jpeg").read_bytes())
+        return ImgCache(store, maxbytes)
+
+
+def variant_key(key, variant):
+        """Key of the variant of the picture key"""
+        return "{}@{}".format(key, variant)
+
+def scale(data, size):
+        """Decodes data, an encoded picture, scaled down to fit in size.
+        JPEG pictures are decoded at a lower resolution directly (see Image.draft)"""
+        img = Image.open(io.BytesIO(data))
+        img.draft(img.mode, size)
+        img.thumbnail(size, Image.LANCZOS)
+        return img
+
+def fits(data, size):
+        """True if data, an encoded picture, fits in size already (only its header is decoded)"""
+        width, height = Image.open(io.BytesIO(data)).size
+        return width <= size[0] and height <= size[1]
+
+def encode(img):
+        file = io.BytesIO()
+        if img.mode in ("RGB", "L") :
+                img.save(file, format="JPEG", quality=90)
+        else :
+                img.save(file, format="PNG")
+        return file.getvalue()
+
+
+class ImgCache :
+        """Implements an images cache. Please don't make two instances \
+        pointing to the same cache file.
+        This is a 2-levels cache : one on disk (see PackStore),
+        the other in RAM.
+        The RAM level is a LRU whose size is bounded by maxbytes,
+        counted in bytes of decoded pixels.
+        It may be used from several threads at once."""
+
+        def __init__(self, store, maxbytes=32*2**20):
+                self.store = store
+                self.lock = threading.RLock()
+                # name -> (image, size in bytes), least recently used first
+                self.ramcache = collections.OrderedDict()
+                self.ramsize = 0
+                self.maxbytes = maxbytes
+                self.hits = 0 # served from RAM
+                self.diskreads = 0 # served from the store
+                self.misses = 0 # not stored at all
+                self.evictions = 0
+
+        def __contains__(self, what) :
+                what = str(what)
+                return what in self.ramcache or what in self.store
+
+        def __getitem__(self, what):
+                what = str(what)
+                with self.lock :
+                        entry = self.ramcache.get(what)
+                        if entry is not None :
+                                self.ramcache.move_to_end(what)
+                                self.hits += 1
+                                return entry[0]
+                        if what not in self.store :
+                                self.misses += 1
+                                raise KeyError("This is not stored yet in this database")
+                        self.diskreads += 1
+                        with instrument.span("imgcache.read"), self.store.open(what) as file :
+                                img = Image.open(file)
+                                img.load()
+                        self._remember(what, img)
+                        return img
+
+        def put(self, key, data):
+                """Stores data, an encoded picture, as is under key (which avoids
+                encoding it again) along with those of its VARIANTS it doesn't fit in,
+                and returns the DETAIL one, decoded.
+                Scaling takes time : better call it from another thread"""
+                key = str(key)
+                with instrument.span("imgcache.scale") :
+                        variants = {name:scale(data, size) for name, size in VARIANTS.items() if not fits(data, size)}
+                        encoded = {name:encode(img) for name, img in variants.items()}
+                with self.lock :
+                        if key not in self.store :
+                                self.store.write(key, data)
+                        for name, img in variants.items() :
+                                if variant_key(key, name) not in self.store :
+                                        self.store.write(variant_key(key, name), encoded[name])
+                                self._remember(variant_key(key, name), img)
+                return variants[DETAIL] if DETAIL in variants else self[key]
+
+        def _read(self, key):
+                """Returns the data stored under key, None if there's none"""
+                with self.lock : # the store may be remapped by another thread meanwhile
+                        if key not in self.store :
+                                return None
+                        with self.store.open(key) as file :
+                                return file.read()
+
+        def ready(self, key, name=DETAIL):
+                """True if the variant name of the picture key may be had without scaling"""
+                if variant_key(key, name) in self :
+                        return True
+                data = self._read(str(key))
+                return data is not None and fits(data, VARIANTS[name])
+
+        def variant(self, key, name=DETAIL):
+                """Returns the variant name of the picture key, decoded.
+                The variants are made (see put) if they weren't stored yet.
+                Raises KeyError if the picture isn't stored"""
+                vkey = variant_key(key, name)
+                if vkey in self :
+                        return self[vkey]
+                key = str(key)
+                data = self._read(key)
+                if data is None :
+                        self.misses += 1
+                        raise KeyError("This is not stored yet in this database")
+                if fits(data, VARIANTS[name]) :
+                        return self[key]
+                self.put(key, data)
+                return self[vkey]
+
+        def _remember(self, key, img):
+                """Puts img in the RAM level, evicting the least recently used
+                pictures until the budget is respected again"""
+                size = img.width * img.height * len(img.getbands())
+                if key in self.ramcache :
+                        self.ramsize -= self.ramcache.pop(key)[1]
+                if size > self.maxbytes :
+                        return
+                self.ramcache[key] = (img, size)
+                self.ramsize += size
+                while self.ramsize > self.maxbytes :
+                        _, (_, freed) = self.ramcache.popitem(last=False)
+                        self.ramsize -= freed
+                        self.evictions += 1
+
+        def close(self):
+                with self.lock :
+                        self.store.close()
+
+        def stats(self):
+                """Returns the counters of the cache, as a dict"""
+                return dict(
+                        hits=self.hits,
+                        diskreads=self.diskreads,
+                        misses=self.misses,
+                        evictions=self.evictions,
+                        ramsize=self.ramsize,
+                        ramentries=len(self.ramcache),
+                        stored=len(self.store))
@@ -0,0 +1,134 @@
+"""Timings and counters of the hot paths (network, caches, filter, sort,
+rendering, files), to tell what makes the application slow.
+Nothing is recorded until enable is called : the hooks then cost about
+one test of the global enabled.
+The spans recorded last are kept as a trace, which dump writes as JSON or CSV."""
+
+import collections, json, threading, time
+
+
+TRACE_LENGTH = 100000 # spans kept in the trace, the oldest ones are forgotten
+
+enabled = False
+lock = threading.Lock() # the fetcher records from its own threads
+epoch = time.perf_counter()
+trace = collections.deque(maxlen=TRACE_LENGTH) # (start, name, duration, thread, detail), times in s since epoch
+totals = dict() # name -> [count, total time, longest, last]
+counters = collections.Counter()
+sources = dict() # name -> function returning counters kept elsewhere (ImgCache.stats, for instance)
+
+
+def enable():
+        global enabled
+        enabled = True
+
+def disable():
+        global enabled
+        enabled = False
+
+def reset():
+        global epoch
+        with lock :
+                epoch = time.perf_counter()
+                trace.clear()
+                totals.clear()
+                counters.clear()
+
+
+class Span :
+        """Records the time taken by its with block under name ;
+        detail (a string) is kept in the trace"""
+
+        __slots__ = ("name", "detail", "start")
+
+        def __init__(self, name, detail=None):
+                self.name = name
+                self.detail = detail
+
+        def __enter__(self):
+                self.start = time.perf_counter()
+                return self
+
+        def __exit__(self, *exc):
+                end = time.perf_counter()
+                record(self.name, self.start, end-self.start, self.detail)
+
+
+class NoSpan :
+        """What span returns when disabled"""
+
+        __slots__ = ()
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, *exc):
+                pass
+
+NOSPAN = NoSpan()
+
+
+def span(name, detail=None):
+        """Context manager timing its block under name, if enabled"""
+        return Span(name, detail) if enabled else NOSPAN
+
+def timed(name):
+        """Decorator timing each call of the function under name, if enabled"""
+        def decorator(f):
+                def f_(*args, **kwargs):
+                        if not enabled :
+                                return f(*args, **kwargs)
+                        with Span(name) :
+                                return f(*args, **kwargs)
+                f_.__name__, f_.__doc__ = f.__name__, f.__doc__
+                return f_
+        return decorator
+
+def count(name, n=1):
+        """Adds n to the counter name, if enabled"""
+        if enabled :
+                with lock :
+                        counters[name] += n
+
+def register(name, source):
+        """Adds the counters returned by source(), a function, to the snapshots"""
+        sources[name] = source
+
+def record(name, start, duration, detail=None):
+        with lock :
+                trace.append((start-epoch, name, duration, threading.current_thread().name, detail))
+                total = totals.get(name)
+                if total is None :
+                        totals[name] = [1, duration, duration, duration]
+                else :
+                        total[0] += 1
+                        total[1] += duration
+                        total[2] = max(total[2], duration)
+                        total[3] = duration
+
+
+def snapshot():
+        """Returns the totals of each span name (count, total, mean, longest and
+        last durations, in s), and the counters, including those of the sources"""
+        with lock :
+                spans = {name:dict(count=c, total=t, mean=t/c, max=m, last=l) for name, (c, t, m, l) in totals.items()}
+                values = dict(counters)
+        for name, source in list(sources.items()) :
+                for key, value in source().items() :
+                        values[name+"."+key] = value
+        return dict(enabled=enabled, spans=spans, counters=values)
+
+def dump(path):
+        """Writes the trace to path : as CSV if its name ends with .csv
+        (one line per span), as JSON otherwise (with the snapshot)"""
+        with lock :
+                spans = list(trace)
+        with open(str(path), "w", newline="") as file :
+                if str(path).endswith(".csv") :
+                        import csv
+                        writer = csv.writer(file)
+                        writer.writerow(["start", "name", "duration", "thread", "detail"])
+                        writer.writerows(spans)
+                else :
+                        fields = ("start", "name", "duration", "thread", "detail")
+                        json.dump(dict(snapshot(), trace=[dict(zip(fields, s)) for s in spans]), file, indent=1)
@@ -0,0 +1,126 @@
+"""Containers of cards"""
+
+
+class CardList :
+        """List of cards knowing the position of each of them.
+        The cards are told apart by identity, since they aren't hashable
+        (and comparing them is slow : see Card.__eq__).
+        The positions are kept up to date on insertions and deletions (only those
+        of the cards after the change move), and computed again lazily after
+        the list was sorted."""
+
+        def __init__(self, cards=()):
+                self.cards = list(cards)
+                self._positions = None # id(card) -> index, None when outdated
+
+        def __len__(self):
+                return len(self.cards)
+
+        def __iter__(self):
+                return iter(self.cards)
+
+        def __getitem__(self, index):
+                return self.cards[index]
+
+        def __delitem__(self, index):
+                if self._positions is None or isinstance(index, slice) :
+                        del self.cards[index]
+                        self._positions = None
+                        return
+                index = range(len(self.cards))[index] # raises IndexError, as list does
+                del self._positions[id(self.cards[index])]
+                del self.cards[index]
+                self._shift(index)
+
+        def __contains__(self, card):
+                return id(card) in self.positions()
+
+        def positions(self):
+                if self._positions is None :
+                        self._positions = {id(card):i for i, card in enumerate(self.cards)}
+                return self._positions
+
+        def index(self, card):
+                try :
+                        return self.positions()[id(card)]
+                except KeyError :
+                        raise ValueError("This card is not in the list") from None
+
+        def append(self, card):
+                self.cards.append(card)
+                if self._positions is not None :
+                        self._positions[id(card)] = len(self.cards)-1
+
+        def insert(self, index, card):
+                if index >= len(self.cards) :
+                        return self.append(card)
+                self.cards.insert(index, card)
+                self._shift(max(index, 0))
+
+        def _shift(self, start):
+                """Updates the positions of the cards from start on, after they moved"""
+                if self._positions is not None :
+                        positions, cards = self._positions, self.cards
+                        for i in range(start, len(cards)) :
+                                positions[id(cards[i])] = i
+
+        def sort(self, key):
+                self.cards.sort(key=key)
+                self._positions = None
+
+
+class Inventory(CardList) :
+        """The cards of a collection, each (set, number) being stored once
+        (adding a card stored already increases its amount),
+        indexed by (set, number) and by multiverseid."""
+
+        def __init__(self, cards=()):
+                super().__init__()
+                self.bykey = dict() # (set, number) -> card
+                self.byid = dict() # multiverseid -> card
+                for card in cards :
+                        self.add(card)
+
+        @staticmethod
+        def key(card):
+                return (card.set, card.number)
+
+        def __contains__(self, card):
+                return self.bykey.get(self.key(card)) is card
+
+        def get(self, set, number):
+                """Returns the card stored for set and number, or None"""
+                return self.bykey.get((set, number))
+
+        def find(self, multiverseid):
+                """Returns the card stored for multiverseid, or None"""
+                return self.byid.get(multiverseid)
+
+        def add(self, card, amount=None, index=None):
+                """Stores amount copies of card (card.amount if amount is None)
+                at index (by default at the end), or adds them to the card with
+                the same set and number if there's one already.
+                Returns the card stored"""
+                stored = self.bykey.get(self.key(card))
+                if stored is not None :
+                        stored += card.amount if amount is None else amount
+                        return stored
+                if amount is not None :
+                        card.amount = amount
+                self.bykey[self.key(card)] = card
+                multiverseid = getattr(card, "multiverseid", None)
+                if multiverseid is not None :
+                        self.byid[multiverseid] = card
+                if index is None :
+                        self.append(card)
+                else :
+                        self.insert(index, card)
+                return card
+
+        def remove(self, card):
+                index = self.index(card)
+                del self.bykey[self.key(card)]
+                multiverseid = getattr(card, "multiverseid", None)
+                if self.byid.get(multiverseid) is card :
+                        del self.byid[multiverseid]
+                del self[index]
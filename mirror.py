@@ -0,0 +1,165 @@
+"""Local SQLite mirror of the sets and cards of the remote API.
+It stores the raw response dicts ; querying the API is the caller's job."""
+
+import sqlite3, json, time, threading, pathlib
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sets (
+        code TEXT PRIMARY KEY COLLATE NOCASE,
+        data TEXT NOT NULL,
+        synced REAL -- time of the last complete download of its cards, NULL if never
+);
+CREATE TABLE IF NOT EXISTS cards (
+        id TEXT PRIMARY KEY,
+        set_code TEXT NOT NULL COLLATE NOCASE,
+        number TEXT,
+        multiverseid INTEGER,
+        data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cards_set_number ON cards (set_code, number);
+CREATE INDEX IF NOT EXISTS cards_multiverseid ON cards (multiverseid);
+CREATE TABLE IF NOT EXISTS names (
+        card_id TEXT NOT NULL,
+        language TEXT NOT NULL,
+        name TEXT NOT NULL COLLATE NOCASE,
+        PRIMARY KEY (card_id, language)
+);
+CREATE INDEX IF NOT EXISTS names_name ON names (name);
+"""
+
+# query parameters of the API the mirror knows how to answer
+SUPPORTED_PARAMS = {"set", "number", "multiverseid", "name", "language"}
+
+
+def card_id(d):
+        """Returns the key of the raw card dict d in the mirror"""
+        if d.get("id") is not None :
+                return d["id"]
+        return "{}/{}/{}".format(d.get("set"), d.get("number"), d.get("name"))
+
+
+class Mirror :
+        """Local copy of the remote cards database.
+        A set is 'synced' once all its cards were downloaded at once :
+        from then on, the queries restricted to it are answered locally only.
+        Lookups of a given card are answered locally when it's stored ;
+        the caller asks the remote API otherwise.
+        It may be used from several threads at once."""
+
+        def __init__(self, filename):
+                self.filename = filename
+                self.lock = threading.Lock()
+                self.db = sqlite3.connect(str(filename), check_same_thread=False)
+                with self.lock, self.db :
+                        self.db.executescript(SCHEMA)
+
+        def close(self):
+                with self.lock :
+                        self.db.close()
+
+        # sets
+
+        def store_sets(self, sets):
+                """Stores the raw set dicts sets, keeping the synchronisation times"""
+                with self.lock, self.db :
+                        self.db.executemany(
+                                "INSERT INTO sets (code, data) VALUES (?, ?) "
+                                "ON CONFLICT (code) DO UPDATE SET data=excluded.data",
+                                [(s["code"], json.dumps(s)) for s in sets])
+
+        def sets(self):
+                """Returns all the raw set dicts stored"""
+                with self.lock :
+                        rows = self.db.execute("SELECT data FROM sets WHERE data != '{}'").fetchall()
+                return [json.loads(data) for data, in rows]
+
+        def synced(self, code):
+                with self.lock :
+                        row = self.db.execute("SELECT synced FROM sets WHERE code = ?", (code,)).fetchone()
+                return row is not None and row[0] is not None
+
+        def set_sizes(self):
+                """Returns the number of cards of each synced set, by code
+                (the two halves of a flip card count as one)"""
+                with self.lock :
+                        rows = self.db.execute(
+                                "SELECT set_code, count(DISTINCT rtrim(number, 'ab')) FROM cards "
+                                "WHERE set_code IN (SELECT code FROM sets WHERE synced IS NOT NULL) "
+                                "GROUP BY set_code").fetchall()
+                return dict(rows)
+
+        def complete(self):
+                """True if every known set is synced"""
+                with self.lock :
+                        known, missing = self.db.execute(
+                                "SELECT count(*), count(*) - count(synced) FROM sets").fetchone()
+                return bool(known) and not missing
+
+        # cards
+
+        def store_cards(self, cards, synced_set=None):
+                """Stores the raw card dicts cards ; if synced_set is given,
+                they are all the cards of that set"""
+                cardrows, namerows = list(), list()
+                for d in cards :
+                        id = card_id(d)
+                        cardrows.append((id, d.get("set"), d.get("number"), d.get("multiverseid"), json.dumps(d)))
+                        namerows.append((id, "English", d.get("name")))
+                        for f in d.get("foreignNames") or () :
+                                namerows.append((id, f["language"], f["name"]))
+                with self.lock, self.db :
+                        self.db.executemany("INSERT OR REPLACE INTO cards VALUES (?, ?, ?, ?, ?)", cardrows)
+                        self.db.executemany("INSERT OR REPLACE INTO names VALUES (?, ?, ?)", namerows)
+                        if synced_set is not None :
+                                self.db.execute("INSERT OR IGNORE INTO sets (code, data) VALUES (?, '{}')", (synced_set,))
+                                self.db.execute("UPDATE sets SET synced = ? WHERE code = ?", (time.time(), synced_set))
+
+        def card(self, id):
+                """Returns the raw card dict whose id is id, or None"""
+                with self.lock :
+                        row = self.db.execute("SELECT data FROM cards WHERE id = ?", (id,)).fetchone()
+                return None if row is None else json.loads(row[0])
+
+        def query(self, params):
+                """Returns the list of the raw card dicts matching the API query
+                parameters params, or None if the mirror can't tell"""
+                params = {k:str(v) for k,v in params.items()}
+                if not set(params) <= SUPPORTED_PARAMS or any("|" in v for v in params.values()) :
+                        return None # OR-queries aren't supported
+                authoritative = self.synced(params["set"]) if "set" in params else (not params and self.complete())
+                clauses, args = list(), list()
+                if "set" in params :
+                        clauses.append("set_code = ?")
+                        args.append(params["set"])
+                if "number" in params :
+                        clauses.append("number = ?")
+                        args.append(params["number"])
+                if "multiverseid" in params :
+                        clauses.append("multiverseid = ?")
+                        args.append(params["multiverseid"])
+                if "name" in params :
+                        clauses.append("id IN (SELECT card_id FROM names WHERE name = ?)")
+                        args.append(params["name"])
+                if params.get("language", "English") != "English" :
+                        # correlated, so that it's served by the primary key of names
+                        clauses.append("EXISTS (SELECT 1 FROM names WHERE card_id = cards.id AND language = ?)")
+                        args.append(params["language"])
+                sql = "SELECT data FROM cards"
+                if clauses :
+                        sql += " WHERE " + " AND ".join(clauses)
+                with self.lock :
+                        rows = self.db.execute(sql+" ORDER BY rowid", args).fetchall()
+                if not authoritative and not (rows and ("number" in params or "multiverseid" in params)) :
+                        # only the lookups of a single card can be trusted on a partial mirror
+                        return None
+                return [json.loads(data) for data, in rows]
+
+
+def open_mirror(path):
+        """Opens the mirror of the application living at path
+        (the zipapp, or the directory of the sources)"""
+        path = pathlib.Path(path)
+        if path.is_dir() :
+                return Mirror(path/"cards.db")
+        return Mirror(path.with_suffix(".db"))
@@ -0,0 +1,94 @@
+"""Precomputed sort keys of the cards"""
+
+import re
+
+
+NUMBER = re.compile("([0-9]*)(.*)")
+
+
+def comparable(value):
+        """Makes value comparable to the other values of the same attribute :
+        lists become tuples, None sorts last"""
+        if value is None :
+                return (1, ())
+        if isinstance(value, list) :
+                value = tuple(value)
+        return (0, value)
+
+def number_key(number):
+        """Sorts the collector numbers numerically : "9" < "10" < "10a" < "10b" """
+        digits, rest = NUMBER.fullmatch(number or "").groups()
+        return (int(digits or 0), rest)
+
+
+class SortKeys :
+        """Computes once the values the cards may be sorted by (some of them
+        are expensive : see Card.foreign_name), and builds sort keys from them.
+        The set and number of the cards end every key, so that the order is
+        the same whatever the former order was.
+        The values don't change with the amount of the cards ; when LANG
+        changes, see switch. The cards are told apart by identity, since they aren't hashable."""
+
+        def __init__(self, attrs, language=None):
+                self.attrs = attrs
+                self.values = dict() # id(card) -> {attr:value}, plus the set and number under None
+                self.language = language # the one the values were computed in
+                self.others = dict() # language -> (values, {id(card):card}) computed in it, until it's LANG again
+
+        def _compute(self, card):
+                values = {attr:comparable(getattr(card, attr, None)) for attr in self.attrs}
+                values[None] = (card.set or "", number_key(card.number))
+                return values
+
+        def add(self, card):
+                if id(card) not in self.values :
+                        self.values[id(card)] = self._compute(card)
+
+        def discard(self, card):
+                self.values.pop(id(card), None)
+                for values, cards in self.others.values() :
+                        values.pop(id(card), None)
+                        cards.pop(id(card), None)
+
+        def sync(self, cards, refresh=False):
+                """Makes the cache hold the values of cards, and only them ;
+                those of the cards it held already are kept, unless refresh is True"""
+                values = self.values
+                self.values = {id(card):values[id(card)] if id(card) in values and not refresh else self._compute(card) \
+                        for card in cards}
+                for values, cards in self.others.values() : # they'd keep the cards not held anymore alive
+                        for i in [i for i in cards if i not in self.values] :
+                                values.pop(i, None)
+                                del cards[i]
+
+        def switch(self, language, cards):
+                """Makes the cache hold the values of cards in language, which LANG
+                has just become : those computed the last time it was are reused,
+                the current ones are kept for when it's switched back"""
+                if language == self.language :
+                        return
+                self.others[self.language] = (self.values, {id(card):card for card in cards}) # keeps their ids valid
+                values, known = self.others.pop(language, (dict(), dict()))
+                self.language = language
+                self.values = {id(card):values[id(card)] if known.get(id(card)) is card else self._compute(card) \
+                        for card in cards}
+
+        def key(self, attrs):
+                """Returns a key function sorting the cards by attrs, in that order"""
+                values = self.values
+                attrs = list(attrs) + [None]
+                return lambda card:tuple(values[id(card)][attr] for attr in attrs)
+
+        def insertion_point(self, cards, card, attrs):
+                """Returns the index where card should be inserted in cards,
+                already sorted by attrs, to keep it sorted"""
+                key = self.key(attrs)
+                k = key(card)
+                lo, hi = 0, len(cards)
+                while lo < hi :
+                        mid = (lo+hi) // 2
+                        if k < key(cards[mid]) :
+                                hi = mid
+                        else :
+                                lo = mid+1
+                return lo